@@ -30,6 +30,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "movies.profiling.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -112,3 +113,52 @@ STATIC_DIR = os.path.join(BASE_DIR, "static")
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Recommender model built by `manage.py build_recommender_model`
+
+RECOMMENDER_SOUP_DATA = os.path.join(STATIC_DIR, "soup_data.parquet")
+RECOMMENDER_MODEL_DIR = os.path.join(BASE_DIR, "recommender_model")
+RECOMMENDER_PRELOAD = True
+RECOMMENDER_NEIGHBOURS = 200
+RECOMMENDER_NEIGHBOUR_MAX_SEEDS = 3
+RECOMMENDER_BACKEND = "exact"  # "exact" or "ivf", see movies.backends
+RECOMMENDER_IVF_PROBES = 8
+
+# Seconds before the in-memory filter index (movies.filter_index) is rebuilt from the database
+FILTER_INDEX_TTL = 300
+
+# `import_movie_data --incremental` writes the ids it added, changed and deleted here
+CATALOGUE_CHANGESET_DIR = os.path.join(BASE_DIR, "changesets")
+
+# Responses of filter-movie/ are cached per catalogue version, see movies.response_cache.
+# FILTER_CACHE_ALIAS names a cache of CACHES shared by every process, None keeps them in process
+FILTER_CACHE_SIZE = 1024
+FILTER_CACHE_TTL = 60
+FILTER_CACHE_ALIAS = None
+
+# Bumped by the commands that change the catalogue or the recommender model, see movies.catalogue
+CATALOGUE_VERSION_FILE = os.path.join(BASE_DIR, "catalogue_version")
+
+# Memory budget of the per-seed score vectors kept by movies.score_cache, 0 disables the cache.
+# "float16" halves the size of every vector at the cost of about 1e-3 relative precision
+RECOMMENDER_SCORE_CACHE_BYTES = 256 * 1024**2
+RECOMMENDER_SCORE_CACHE_DTYPE = "float32"
+
+# Threads scoring the query blocks of recommendations/batch/, -1 uses every CPU
+RECOMMENDER_BATCH_JOBS = -1
+
+# Scoring threads of the async views served through ASGI, and the number of requests allowed to
+# wait for them before async/filter-movie/ answers 503
+RECOMMENDER_ASYNC_WORKERS = 4
+RECOMMENDER_ASYNC_MAX_PENDING = 64
+
+# Sampled cProfile capture of the requests served synchronously, see movies.profiling. One in
+# REQUEST_PROFILE_SAMPLE_RATE requests (0 for none) and every request slower than
+# REQUEST_PROFILE_SLOW_MS (None for none) is kept; the latter profiles every request
+REQUEST_PROFILING = False
+REQUEST_PROFILE_SAMPLE_RATE = 100
+REQUEST_PROFILE_SLOW_MS = None
+REQUEST_PROFILE_MEMORY = False
+REQUEST_PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+REQUEST_PROFILE_KEEP = 200
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MoviesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "movies"
+
+    def ready(self):
+        from .recommender import RecommenderModel, get_model
+
+        if settings.RECOMMENDER_PRELOAD and RecommenderModel.exists(settings.RECOMMENDER_MODEL_DIR):
+            get_model()
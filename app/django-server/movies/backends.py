@@ -0,0 +1,209 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from movies.catalogue import atomic_write
+from movies.recommender import SPACES, get_model
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """Inverted-file index over TruncatedSVD-reduced soup vectors.
+
+    Every movie is reduced to one L2-normalised block per space and the concatenated vectors
+    are clustered with spherical k-means. ``order[offsets[i]:offsets[i + 1]]`` lists the rows
+    assigned to centroid ``i``.
+    """
+
+    def __init__(self, components, vectors, centroids, order, offsets):
+        self.components = components
+        self.vectors = vectors
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, model, n_lists=None, n_components=64, n_iter=10, random_state=0):
+        components = {}
+        blocks = []
+        for space in SPACES:
+            matrix = model.matrices[space]
+            svd = TruncatedSVD(
+                n_components=max(1, min(n_components, matrix.shape[1] - 1)), random_state=random_state
+            )
+            blocks.append(normalize(svd.fit_transform(matrix)).astype(np.float32))
+            components[space] = svd.components_.astype(np.float32)
+        vectors = np.hstack(blocks)
+
+        n_lists = min(n_lists or int(np.sqrt(len(vectors))), len(vectors))
+        centroids, assignment = _spherical_kmeans(vectors, n_lists, n_iter, random_state)
+        return cls(components, vectors, centroids, *_inverted_lists(assignment, n_lists))
+
+    def update(self, model, old_rows):
+        """Index for ``model`` as returned by ``update_model`` together with ``old_rows``.
+
+        Kept rows stay in their lists and upserted rows join the list of their nearest
+        centroid; the centroids themselves are only refitted by a full build.
+        """
+        n_upserted = len(model) - len(old_rows)
+        upserted = np.zeros((n_upserted, self.vectors.shape[1]), dtype=np.float32)
+        if n_upserted:
+            upserted[:] = np.hstack(
+                [
+                    normalize(model.matrices[space][len(old_rows) :] @ self.components[space].T)
+                    for space in SPACES
+                ]
+            )
+        assignment = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))[np.argsort(self.order)]
+        centroids = np.asarray(self.centroids)
+        assignment = np.concatenate([assignment[old_rows], _assign(upserted, centroids)])
+        vectors = np.vstack([np.asarray(self.vectors)[old_rows], upserted])
+        return IVFIndex(self.components, vectors, centroids, *_inverted_lists(assignment, self.n_lists))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for space in SPACES:
+            atomic_write(
+                os.path.join(directory, f"{space}_components.npy"),
+                lambda file: np.save(file, self.components[space]),
+            )
+        for name in ("vectors", "centroids", "order", "offsets"):
+            atomic_write(
+                os.path.join(directory, f"{name}.npy"), lambda file: np.save(file, getattr(self, name))
+            )
+
+    @classmethod
+    def load(cls, directory):
+        components = {space: np.load(os.path.join(directory, f"{space}_components.npy")) for space in SPACES}
+        arrays = [
+            np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ("vectors", "centroids", "order", "offsets")
+        ]
+        return cls(components, *arrays)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "offsets.npy"))
+
+    def query_vector(self, rows, weight_plot):
+        query = np.asarray(self.vectors[rows]).mean(axis=0)
+        half = self.components["plot"].shape[0]
+        query[:half] *= weight_plot
+        query[half:] *= 1 - weight_plot
+        return query
+
+    def probe(self, rows, weight_plot, n_probe):
+        """Rows in the ``n_probe`` lists whose centroids best match the seeds."""
+        n_probe = min(n_probe, self.n_lists)
+        similarity = np.asarray(self.centroids) @ self.query_vector(rows, weight_plot)
+        lists = np.argpartition(-similarity, n_probe - 1)[:n_probe]
+        return np.concatenate([self.order[self.offsets[i] : self.offsets[i + 1]] for i in lists])
+
+
+def _inverted_lists(assignment, n_lists):
+    order = np.argsort(assignment, kind="stable").astype(np.int32)
+    offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1)).astype(np.int64)
+    return order, offsets
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + chunk_size] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk_size)
+        ]
+    )
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter, random_state):
+    rng = np.random.default_rng(random_state)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = _assign(vectors, centroids)
+        members = sparse.csr_matrix(
+            (np.ones(len(vectors), dtype=np.float32), (assignment, np.arange(len(vectors)))),
+            shape=(n_lists, len(vectors)),
+        )
+        sums = np.asarray(members @ vectors)
+        filled = np.linalg.norm(sums, axis=1) > 0
+        centroids[filled] = normalize(sums[filled])
+    return centroids, _assign(vectors, centroids)
+
+
+class ExactBackend:
+    """Scores every movie in the catalogue."""
+
+    name = "exact"
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model)
+
+    def candidates(self, rows, weight_plot):
+        return None
+
+
+class IVFBackend(ExactBackend):
+    """Scores only the movies in the IVF lists nearest to the seeds.
+
+    ``n_probe`` trades recall for latency: more probed lists means more candidates scored.
+    """
+
+    name = "ivf"
+
+    def __init__(self, model, index, n_probe=8):
+        super().__init__(model)
+        self.index = index
+        self.n_probe = n_probe
+
+    @classmethod
+    def from_model(cls, model):
+        """IVF backend of ``model``, or the exact one when no index was saved with the model or it
+        was built for another catalogue."""
+        index_directory = os.path.join(model.directory, "ivf") if model.directory is not None else None
+        if index_directory is not None and IVFIndex.exists(index_directory):
+            index = IVFIndex.load(index_directory)
+            if len(index.order) == len(model):
+                return cls(model, index, settings.RECOMMENDER_IVF_PROBES)
+            logger.warning(
+                "Ignoring the IVF index of %s, it does not match the model's movies", index_directory
+            )
+        else:
+            logger.warning("No IVF index in %s, scoring every movie", index_directory)
+        return ExactBackend(model)
+
+    def candidates(self, rows, weight_plot):
+        return self.index.probe(rows, weight_plot, self.n_probe)
+
+
+BACKENDS = {backend.name: backend for backend in (ExactBackend, IVFBackend)}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend of ``RECOMMENDER_BACKEND`` over the current model, or None while there is none."""
+    global _backend
+    model = get_model()
+    if model is None:
+        return None
+    if _backend is None or _backend.model is not model:
+        with _backend_lock:
+            if _backend is None or _backend.model is not model:
+                backend_class = BACKENDS[settings.RECOMMENDER_BACKEND]
+                _backend = backend_class.from_model(model)
+    return _backend
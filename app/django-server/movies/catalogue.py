@@ -0,0 +1,40 @@
+import os
+
+from django.conf import settings
+
+_version = (None, 0)
+
+
+def atomic_write(path, write, mode="wb"):
+    """Write through a temporary file renamed over ``path``.
+
+    Processes that still have the old file open or memory-mapped keep reading the old copy.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, mode) as file:
+        write(file)
+    os.replace(temporary_path, path)
+
+
+def catalogue_version():
+    """Version of the catalogue, bumped by every command that changes the movies or the model.
+
+    The version lives in ``settings.CATALOGUE_VERSION_FILE`` so that every server process sees
+    the bumps; the file is only re-read when it was replaced.
+    """
+    global _version
+    try:
+        stat = os.stat(settings.CATALOGUE_VERSION_FILE)
+    except FileNotFoundError:
+        return 0
+    signature = (stat.st_ino, stat.st_mtime_ns)
+    if signature != _version[0]:
+        with open(settings.CATALOGUE_VERSION_FILE) as file:
+            _version = (signature, int(file.read().strip() or 0))
+    return _version[1]
+
+
+def bump_catalogue_version():
+    version = catalogue_version() + 1
+    atomic_write(settings.CATALOGUE_VERSION_FILE, lambda file: file.write(str(version)), mode="w")
+    return version
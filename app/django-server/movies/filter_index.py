@@ -0,0 +1,168 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from movies.catalogue import catalogue_version
+from movies.models import Genre, Movie, Providers
+
+RELATIONS = {
+    "genres": (Genre, "genre_id"),
+    "streaming": (Providers, "providers_id"),
+    "buy": (Providers, "providers_id"),
+    "rent": (Providers, "providers_id"),
+}
+YEAR_LOOKUPS = {
+    "gt": np.greater,
+    "gte": np.greater_equal,
+    "lt": np.less,
+    "lte": np.less_equal,
+}
+
+
+def _group(keys, ids):
+    """Sorted unique ids per key, from parallel key/id arrays."""
+    order = np.lexsort((ids, keys))
+    keys = keys[order]
+    ids = ids[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=int)
+    ends = np.r_[starts[1:], len(keys)]
+    return {key: np.unique(ids[start:end]) for key, start, end in zip(keys[starts].tolist(), starts, ends)}
+
+
+def _union(arrays):
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int64)
+
+
+class FilterIndex:
+    """In-memory posting lists answering the ``Movie.objects.filter`` lookups used by the API.
+
+    Supports ``id``/``pk``, ``free``, ``year`` (exact, ``in`` and comparisons) and exact or
+    ``in`` lookups on the primary key of the genres/streaming/buy/rent relations. ``filter``
+    returns None for anything else so the caller can fall back to the ORM.
+    """
+
+    def __init__(self, ids, relations, free, years, version=0):
+        self.ids = ids
+        self.relations = relations
+        self.free = free
+        self.not_free = np.setdiff1d(ids, free, assume_unique=True)
+        self.years = years
+        self.year_keys = np.array(sorted(years), dtype=object)
+        self.version = version
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        version = catalogue_version()
+        ids = np.fromiter(Movie.objects.order_by("id").values_list("id", flat=True), dtype=np.int64)
+        relations = {}
+        for relation, (_, column) in RELATIONS.items():
+            links = np.array(
+                list(getattr(Movie, relation).through.objects.values_list(column, "movie_id")), dtype=np.int64
+            ).reshape(-1, 2)
+            relations[relation] = _group(links[:, 0], links[:, 1])
+        free = np.fromiter(
+            Movie.objects.filter(free=True).order_by("id").values_list("id", flat=True), dtype=np.int64
+        )
+        years = np.array(list(Movie.objects.values_list("year", "id")), dtype=object).reshape(-1, 2)
+        years = _group(years[:, 0].astype(str), years[:, 1].astype(np.int64))
+        years.pop("None", None)
+        return cls(ids, relations, free, years, version)
+
+    def _relation(self, relation, field, lookup, value):
+        model, _ = RELATIONS[relation]
+        if field not in (None, "pk", model._meta.pk.name):
+            return None
+        if lookup == "exact":
+            values = [value]
+        elif lookup == "in":
+            values = value
+        else:
+            return None
+        postings = self.relations[relation]
+        keys = {model._meta.pk.to_python(item) for item in values}
+        return _union([postings[key] for key in keys if key in postings])
+
+    def _year(self, lookup, value):
+        if lookup == "exact":
+            values = [value]
+        elif lookup == "in":
+            values = value
+        elif lookup in YEAR_LOOKUPS:
+            values = self.year_keys[YEAR_LOOKUPS[lookup](self.year_keys, str(value))]
+        else:
+            return None
+        return _union([self.years[str(item)] for item in values if str(item) in self.years])
+
+    def _lookup(self, key, value):
+        if value is None:
+            return None
+        parts = key.split("__")
+        lookup = parts.pop() if len(parts) > 1 and parts[-1] in ("exact", "in", *YEAR_LOOKUPS) else "exact"
+        name = parts[0]
+        field = parts[1] if len(parts) == 2 else None
+        if len(parts) > 2:
+            return None
+
+        if name in RELATIONS:
+            return self._relation(name, field, lookup, value)
+        if field is not None:
+            return None
+        if name in ("id", "pk") and lookup in ("exact", "in"):
+            values = [value] if lookup == "exact" else value
+            return np.intersect1d(self.ids, np.array([int(item) for item in values], dtype=np.int64))
+        if name == "free" and lookup == "exact":
+            return self.free if Movie._meta.get_field("free").to_python(value) else self.not_free
+        if name == "year":
+            return self._year(lookup, value)
+        return None
+
+    def filter(self, filters):
+        """Sorted ids matching every filter, or None when a filter is not indexed.
+
+        Conditions on the same relation must hold for one related row in a single ORM
+        ``filter`` call, which posting lists cannot tell apart, so those are not indexed either.
+        """
+        relations = [key.split("__")[0] for key in filters if key.split("__")[0] in RELATIONS]
+        if len(relations) != len(set(relations)):
+            return None
+        result = None
+        for key, value in filters.items():
+            try:
+                matches = self._lookup(key, value)
+            except (TypeError, ValueError, ValidationError):
+                return None
+            if matches is None:
+                return None
+            result = matches if result is None else np.intersect1d(result, matches, assume_unique=True)
+        return self.ids if result is None else result
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _stale(index):
+    ttl = settings.FILTER_INDEX_TTL
+    if index is None or index.version != catalogue_version():
+        return True
+    return ttl is not None and time.monotonic() - index.built_at > ttl
+
+
+def get_filter_index():
+    global _index
+    if _stale(_index):
+        with _index_lock:
+            if _stale(_index):
+                _index = FilterIndex.build()
+    return _index
+
+
+def reset_filter_index():
+    global _index
+    with _index_lock:
+        _index = None
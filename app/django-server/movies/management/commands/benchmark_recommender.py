@@ -0,0 +1,76 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...backends import IVFBackend, IVFIndex
+from ...recommender import RecommenderModel, score, top_n
+
+
+class Command(BaseCommand):
+    help = "Compare recall@k and latency of the IVF backend against exact scoring."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=settings.RECOMMENDER_MODEL_DIR)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--seeds", type=int, default=5, help="Seed movies per query.")
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--probes", default="1,2,4,8,16,32", help="Comma separated n_probe values.")
+        parser.add_argument("--weight-plot", type=float, default=0.7)
+
+    @staticmethod
+    def _timed(function):
+        start = time.perf_counter()
+        result = function()
+        return result, (time.perf_counter() - start) * 1000
+
+    def handle(self, *args, **options):
+        model = RecommenderModel.load(options["model"])
+        index_directory = os.path.join(model.directory, "ivf")
+        if IVFIndex.exists(index_directory):
+            index = IVFIndex.load(index_directory)
+        else:
+            print("No IVF index found, building one in memory")
+            index = IVFIndex.build(model)
+
+        k = options["k"]
+        weight_plot = options["weight_plot"]
+        rng = np.random.default_rng(0)
+        queries = [rng.choice(len(model), options["seeds"], replace=False) for _ in range(options["queries"])]
+
+        exact_results = []
+        exact_latencies = []
+        for rows in queries:
+            result, latency = self._timed(lambda: top_n(score(model, rows, weight_plot), k, exclude=rows))
+            exact_results.append(set(result.tolist()))
+            exact_latencies.append(latency)
+
+        print(f"{len(model)} movies, {index.n_lists} IVF lists, {len(queries)} queries")
+        print(f"{'backend':<14}{'recall@' + str(k):>10}{'candidates':>12}{'p50 ms':>10}{'p95 ms':>10}")
+        print(
+            f"{'exact':<14}{1.0:>10.3f}{len(model):>12}{np.percentile(exact_latencies, 50):>10.2f}"
+            f"{np.percentile(exact_latencies, 95):>10.2f}"
+        )
+
+        for n_probe in [int(value) for value in options["probes"].split(",")]:
+            backend = IVFBackend(model, index, n_probe)
+            recalls = []
+            latencies = []
+            n_candidates = []
+
+            def search(rows):
+                candidates = backend.candidates(rows, weight_plot)
+                scores = score(model, rows, weight_plot, candidates)
+                return candidates, candidates[top_n(scores, k, exclude=np.isin(candidates, rows))]
+
+            for rows, expected in zip(queries, exact_results):
+                (candidates, result), latency = self._timed(lambda: search(rows))
+                recalls.append(len(expected & set(result.tolist())) / k)
+                latencies.append(latency)
+                n_candidates.append(len(candidates))
+            print(
+                f"{'ivf/' + str(n_probe):<14}{np.mean(recalls):>10.3f}{int(np.mean(n_candidates)):>12}"
+                f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}"
+            )
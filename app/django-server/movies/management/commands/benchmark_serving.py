@@ -0,0 +1,89 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from ...models import Movie
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the sync filter-movie/ view through the WSGI handler and async/filter-movie/ through "
+        "the ASGI handler with similar payloads, and compare their throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--seeds", type=int, default=3, help="Seed movies per request.")
+        parser.add_argument("--n-movies", type=int, default=10)
+
+    def _payloads(self, options):
+        ids = np.fromiter(Movie.objects.values_list("id", flat=True), dtype=np.int64)
+        rng = np.random.default_rng(0)
+        return [
+            {
+                "ids": rng.choice(ids, options["seeds"], replace=False).tolist(),
+                "n_movies": options["n_movies"],
+            }
+            for _ in range(2 * options["requests"])
+        ]
+
+    @staticmethod
+    def _wsgi(payloads, concurrency):
+        client = Client()
+
+        def post(payload):
+            start = time.perf_counter()
+            response = client.post("/filter-movie/", payload, content_type="application/json")
+            return response.status_code, time.perf_counter() - start
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(post, payloads))
+
+    @staticmethod
+    async def _asgi(payloads, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(payload):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/async/filter-movie/", payload, content_type="application/json")
+                return response.status_code, time.perf_counter() - start
+
+        return await asyncio.gather(*(post(payload) for payload in payloads))
+
+    def _report(self, name, results, elapsed):
+        statuses = np.array([status for status, _ in results])
+        latencies = np.array([latency for _, latency in results]) * 1000
+        print(
+            f"{name:<6}{len(results) / elapsed:>10.1f}{np.percentile(latencies, 50):>10.2f}"
+            f"{np.percentile(latencies, 95):>10.2f}{np.percentile(latencies, 99):>10.2f}"
+            f"{int((statuses == 503).sum()):>8}{int(((statuses != 200) & (statuses != 503)).sum()):>8}"
+        )
+
+    # The score cache would let the second path reuse the seeds scored by the first
+    @override_settings(RECOMMENDER_SCORE_CACHE_BYTES=0)
+    def handle(self, *args, **options):
+        payloads = self._payloads(options)
+        concurrency = options["concurrency"]
+        # Warm the model and the filter index before timing
+        Client().post(
+            "/filter-movie/", {"ids": payloads[0]["ids"], "n_movies": 1}, content_type="application/json"
+        )
+
+        print(f"{options['requests']} requests per path, concurrency {concurrency}")
+        print(f"{'path':<6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'503':>8}{'errors':>8}")
+
+        # Each path gets its own payloads so neither hits responses cached by the other
+        start = time.perf_counter()
+        results = self._wsgi(payloads[: options["requests"]], concurrency)
+        self._report("wsgi", results, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results = asyncio.run(self._asgi(payloads[options["requests"] :], concurrency))
+        self._report("asgi", results, time.perf_counter() - start)
@@ -0,0 +1,235 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import psutil
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from ...filter_index import get_filter_index, reset_filter_index
+from ...recommender import RecommenderModel, set_model
+from ...synthetic import FILTERS, N_GENRES, N_PROVIDERS, generate_catalogue
+from ...views import GetMoviesIdsView, get_recommendations
+
+
+class PeakRSS:
+    """Highest resident set size of the process while the block runs, sampled every ``interval``."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self.start = self.peak = self.process.memory_info().rss
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic catalogues and measure import, model build, filtering and scoring on each, "
+        "writing build times, latency percentiles and peak RSS to JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000,500000", help="Comma separated titles.")
+        parser.add_argument("--queries", type=int, default=200, help="Timed calls per latency stage.")
+        parser.add_argument(
+            "--seeds",
+            type=int,
+            default=settings.RECOMMENDER_NEIGHBOUR_MAX_SEEDS,
+            help="Seed movies of multi-seed queries; the many_seed stage uses two more, past the "
+            "neighbour tables.",
+        )
+        parser.add_argument(
+            "--neighbours",
+            type=int,
+            default=settings.RECOMMENDER_NEIGHBOURS,
+            help="Neighbours kept per movie and space, as build_recommender_model; 0 skips them.",
+        )
+        parser.add_argument("--jobs", type=int, default=-1, help="Worker processes for the neighbour build.")
+        parser.add_argument("--n-movies", type=int, default=10)
+        parser.add_argument("--batch-size", type=int, default=1000, help="Batch size of the import.")
+        parser.add_argument("--output", default="benchmark_results.json")
+        parser.add_argument("--work-dir", default=None, help="Where catalogues are generated (temporary).")
+
+    @staticmethod
+    def _timed(function):
+        """Wall time in seconds and peak RSS of one call."""
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+        stage = {
+            "seconds": elapsed,
+            "peak_rss_mb": rss.peak / 2**20,
+            "rss_growth_mb": (rss.peak - rss.start) / 2**20,
+        }
+        return result, stage
+
+    @classmethod
+    def _latencies(cls, function, inputs):
+        """Latency percentiles in milliseconds of ``function`` over ``inputs``."""
+
+        def run():
+            latencies = []
+            for item in inputs:
+                start = time.perf_counter()
+                function(item)
+                latencies.append((time.perf_counter() - start) * 1000)
+            return np.array(latencies)
+
+        latencies, stage = cls._timed(run)
+        stage["latency_ms"] = {
+            "p50": np.percentile(latencies, 50),
+            "p95": np.percentile(latencies, 95),
+            "p99": np.percentile(latencies, 99),
+            "mean": latencies.mean(),
+            "max": latencies.max(),
+        }
+        stage["calls"] = len(latencies)
+        return stage
+
+    def _report(self, name, stage):
+        latency = stage.get("latency_ms")
+        percentiles = f"p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, " if latency else ""
+        print(f"  {name:<20}{stage['seconds']:>9.2f}s  {percentiles}peak RSS {stage['peak_rss_mb']:.0f} MiB")
+
+    def _run_size(self, size, directory, options):
+        stages = {}
+
+        def measure(name, function):
+            result, stages[name] = self._timed(function)
+            self._report(name, stages[name])
+            return result
+
+        def measure_latencies(name, function, inputs):
+            stages[name] = self._latencies(function, inputs)
+            self._report(name, stages[name])
+
+        ids = measure("generate", lambda: generate_catalogue(directory, size))
+        # import_movie_data prints a line per batch
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, stages["import"] = self._timed(
+                lambda: call_command("import_movie_data", bulk=True, batch_size=options["batch_size"])
+            )
+        self._report("import", stages["import"])
+
+        soup_data_path = os.path.join(directory, "soup_data.parquet")
+        model = measure("model_build", lambda: RecommenderModel.build(pd.read_parquet(soup_data_path)))
+        if options["neighbours"] > 0:
+            measure("neighbour_build", lambda: model.build_neighbours(options["neighbours"], options["jobs"]))
+        model_directory = os.path.join(directory, "model")
+        measure("model_save", lambda: model.save(model_directory))
+        # Serve from the memory-mapped model and its neighbour tables, as the server does
+        model = measure("model_load", lambda: RecommenderModel.load(model_directory))
+        set_model(model)
+
+        reset_filter_index()
+        measure("filter_index_build", get_filter_index)
+
+        view = GetMoviesIdsView()
+        n_movies = options["n_movies"]
+        queries = options["queries"]
+        rng = np.random.default_rng(0)
+        filters = [FILTERS[index % len(FILTERS)] for index in range(queries)]
+        single_seeds = [rng.choice(ids, 1).tolist() for _ in range(queries)]
+        multi_seeds = [rng.choice(ids, options["seeds"], replace=False).tolist() for _ in range(queries)]
+        many_seeds = [rng.choice(ids, options["seeds"] + 2, replace=False).tolist() for _ in range(queries)]
+
+        measure_latencies("filtering", view.filtered_ids, filters)
+        measure_latencies(
+            "single_seed", lambda seeds: get_recommendations(seeds, n_movies=n_movies), single_seeds
+        )
+        measure_latencies(
+            "multi_seed", lambda seeds: get_recommendations(seeds, n_movies=n_movies), multi_seeds
+        )
+        measure_latencies(
+            "many_seed", lambda seeds: get_recommendations(seeds, n_movies=n_movies), many_seeds
+        )
+        measure_latencies(
+            "filtered_multi_seed",
+            lambda query: get_recommendations(
+                query[0], n_movies=n_movies, candidate_ids=view.filtered_ids(query[1])
+            ),
+            list(zip(multi_seeds, filters)),
+        )
+        return stages
+
+    def _run(self, size, work_dir, options):
+        with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+            test_settings = connection.settings_dict["TEST"]
+            test_name = test_settings.get("NAME")
+            # A file database, so the import is measured with real disk writes
+            if connection.vendor == "sqlite":
+                test_settings["NAME"] = os.path.join(directory, "benchmark.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with override_settings(
+                    STATIC_DIR=directory,
+                    CATALOGUE_VERSION_FILE=os.path.join(directory, "catalogue_version"),
+                    FILTER_INDEX_TTL=None,
+                    # Every query should pay for its scoring
+                    RECOMMENDER_SCORE_CACHE_BYTES=0,
+                    RECOMMENDER_BACKEND="exact",
+                ):
+                    return self._run_size(size, directory, options)
+            finally:
+                set_model(None)
+                reset_filter_index()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings["NAME"] = test_name
+
+    def handle(self, *args, **options):
+        results = {
+            "commit": _git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "options": {
+                key: options[key] for key in ("queries", "seeds", "neighbours", "n_movies", "batch_size")
+            },
+            "neighbour_max_seeds": settings.RECOMMENDER_NEIGHBOUR_MAX_SEEDS,
+            "catalogue": {"genres": N_GENRES, "providers": N_PROVIDERS},
+            "sizes": {},
+        }
+        for size in [int(value) for value in options["sizes"].split(",")]:
+            print(f"{size} movies")
+            results["sizes"][str(size)] = self._run(size, options["work_dir"], options)
+
+        with open(options["output"], "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {options['output']}")
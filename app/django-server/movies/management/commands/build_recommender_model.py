@@ -0,0 +1,46 @@
+import time
+
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...backends import IVFIndex
+from ...catalogue import bump_catalogue_version
+from ...recommender import RecommenderModel
+
+
+class Command(BaseCommand):
+    help = "Fit the soup vectorizers and persist the normalised plot/general matrices."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--soup-data", default=settings.RECOMMENDER_SOUP_DATA)
+        parser.add_argument("--output", default=settings.RECOMMENDER_MODEL_DIR)
+        parser.add_argument(
+            "--neighbours",
+            type=int,
+            default=settings.RECOMMENDER_NEIGHBOURS,
+            help="Neighbours kept per movie and space; 0 skips the neighbour tables.",
+        )
+        parser.add_argument("--jobs", type=int, default=-1, help="Worker processes for the neighbour build.")
+        parser.add_argument(
+            "--ivf", action="store_true", help="Also build the IVF index used by the ivf backend."
+        )
+        parser.add_argument(
+            "--ivf-lists", type=int, default=None, help="Number of IVF lists (default sqrt(N))."
+        )
+        parser.add_argument("--ivf-components", type=int, default=64)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        soup_data = pd.read_parquet(options["soup_data"], columns=["id", "soup_plot", "soup_general"])
+        model = RecommenderModel.build(soup_data)
+        if options["neighbours"] > 0:
+            model.build_neighbours(options["neighbours"], options["jobs"])
+        attachments = {}
+        if options["ivf"]:
+            attachments["ivf"] = IVFIndex.build(model, options["ivf_lists"], options["ivf_components"])
+        # A new generation, so the neighbour tables and IVF index of the previous model are not kept
+        model.save(options["output"], attachments)
+        bump_catalogue_version()
+        elapsed = time.perf_counter() - start
+        print(f"Model with {len(model)} movies saved to {options['output']} in {elapsed:.1f}s")
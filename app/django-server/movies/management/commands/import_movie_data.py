@@ -1,22 +1,68 @@
+import hashlib
+import json
 import os
+import time
+from datetime import datetime, timezone
 
+import numpy as np
 import pandas as pd
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from ...catalogue import bump_catalogue_version
 from ...models import Genre, Movie, Providers
 
+MOVIE_FIELDS = ["title", "overview", "poster_path", "year", "runtime", "actors", "free", "link"]
+RELATION_COLUMNS = {"genres": "genre_ids", "streaming": "flatrate", "buy": "buy", "rent": "rent"}
+HASHED_COLUMNS = ["id", *MOVIE_FIELDS, *RELATION_COLUMNS.values()]
+
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Upsert movies and their genre/provider links with set-based bulk queries.",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only touch movies whose content hash was added, changed or deleted, and write a changeset.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--changeset", default=None, help="Where to write the changeset JSON.")
+
     @staticmethod
     def _split_ids(data):
+        """Ids of a relation column, either comma separated or a native list as in build_app_data."""
+        if isinstance(data, (list, tuple, np.ndarray)):
+            return [int(id) for id in data]
         return data.split(",") if data is not None else []
 
+    @staticmethod
+    def _movie_fields(movie_data):
+        return dict(
+            id=movie_data.id,
+            title=movie_data.title,
+            overview=movie_data.overview,
+            poster_path=movie_data.poster_path,
+            year=movie_data.year,
+            runtime=movie_data.runtime,
+            actors=movie_data.actors,
+            free=(
+                movie_data.free
+                if movie_data.free is not None and isinstance(movie_data.free, bool)
+                else False
+            ),
+            link=movie_data.link,
+        )
+
     @staticmethod
     def _create_providers(providers_data):
         _providers: list[Providers] = []
+        existing_ids = set(Providers.objects.values_list("pk", flat=True))
         for provider_data in providers_data.itertuples():
-            if not Providers.objects.filter(pk=provider_data.provider_id).exists():
+            if provider_data.provider_id not in existing_ids:
                 provider_instance = Providers(
                     logo_path=provider_data.logo_path,
                     provider_name=provider_data.provider_name,
@@ -30,8 +76,9 @@ class Command(BaseCommand):
     @staticmethod
     def _create_genres(genres_data):
         _genres: list[Genre] = []
+        existing_ids = set(Genre.objects.values_list("pk", flat=True))
         for genre_data in genres_data.itertuples():
-            if not Genre.objects.filter(pk=genre_data.id).exists():
+            if genre_data.id not in existing_ids:
                 genre_instance = Genre(
                     id=genre_data.id,
                     name=genre_data.name,
@@ -44,7 +91,8 @@ class Command(BaseCommand):
     def _create_movies(self, movies_data):
         count = 0
         total_movies = len(movies_data)
-        for movie_data in movies_data.itertuples():
+        content_hashes = self._content_hashes(movies_data)
+        for movie_data, content_hash in zip(movies_data.itertuples(), content_hashes):
             try:
                 genre_ids = self._split_ids(movie_data.genre_ids)
                 rent_ids = self._split_ids(movie_data.rent)
@@ -55,23 +103,15 @@ class Command(BaseCommand):
                 streaming_providers = Providers.objects.filter(provider_id__in=flatrate_ids or [])
                 buy_providers = Providers.objects.filter(provider_id__in=buy_ids or [])
                 if movie_data.id is not None or movie_data.title is not None:
-                    instance, created = Movie.objects.get_or_create(
-                        id=movie_data.id,
-                        title=movie_data.title,
-                        overview=movie_data.overview,
-                        poster_path=movie_data.poster_path,
-                        year=movie_data.year,
-                        runtime=movie_data.runtime,
-                        actors=movie_data.actors,
-                        free=movie_data.free
-                        if movie_data.free is not None and isinstance(movie_data.free, bool)
-                        else False,
-                        link=movie_data.link,
+                    fields = self._movie_fields(movie_data)
+                    instance, created = Movie.objects.update_or_create(
+                        id=fields.pop("id"), defaults={**fields, "content_hash": content_hash}
                     )
-                    [instance.genres.add(genre) for genre in genres]
-                    [instance.streaming.add(streaming) for streaming in streaming_providers]
-                    [instance.buy.add(buy) for buy in buy_providers]
-                    [instance.rent.add(rent) for rent in rent_providers]
+                    # The stored hash describes these links, so links no longer in the data go
+                    instance.genres.set(genres)
+                    instance.streaming.set(streaming_providers)
+                    instance.buy.set(buy_providers)
+                    instance.rent.set(rent_providers)
 
                     instance.save()
                     count += 1
@@ -82,6 +122,106 @@ class Command(BaseCommand):
                 print(str(e), f"Error in data{movie_data}")
         print("Task finish")
 
+    def _relation_ids(self, data, known_ids):
+        if not isinstance(data, (str, list, tuple, np.ndarray)):
+            return set()
+        return {int(id) for id in self._split_ids(data) if str(id).strip()} & known_ids
+
+    @staticmethod
+    def _hashed_value(value):
+        # Native id lists hash like the comma separated strings, so switching formats changes nothing
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return ", ".join(str(item) for item in value)
+        return value
+
+    @classmethod
+    def _content_hashes(cls, movies_data):
+        rows = movies_data[HASHED_COLUMNS].astype(object).where(movies_data[HASHED_COLUMNS].notna(), None)
+        return [
+            hashlib.blake2b(
+                json.dumps([cls._hashed_value(value) for value in row], default=str).encode(), digest_size=16
+            ).hexdigest()
+            for row in rows.itertuples(index=False, name=None)
+        ]
+
+    def _bulk_create_movies(self, movies_data, batch_size):
+        known_ids = {
+            "genres": set(Genre.objects.values_list("pk", flat=True)),
+            "streaming": set(Providers.objects.values_list("pk", flat=True)),
+        }
+        known_ids["buy"] = known_ids["rent"] = known_ids["streaming"]
+
+        movies_data = movies_data[movies_data["id"].notna()]
+        total_movies = len(movies_data)
+        count = 0
+        start = time.perf_counter()
+        for batch_start in range(0, total_movies, batch_size):
+            batch = movies_data.iloc[batch_start : batch_start + batch_size]
+            movies = [
+                Movie(**self._movie_fields(movie_data), content_hash=content_hash)
+                for movie_data, content_hash in zip(batch.itertuples(), self._content_hashes(batch))
+            ]
+            with transaction.atomic():
+                Movie.objects.bulk_create(
+                    movies,
+                    update_conflicts=True,
+                    unique_fields=["id"],
+                    update_fields=[*MOVIE_FIELDS, "content_hash"],
+                )
+                for relation, column in RELATION_COLUMNS.items():
+                    field = Movie._meta.get_field(relation)
+                    through = field.remote_field.through
+                    # Replace the links of the upserted movies, so removed genres/providers go too
+                    through.objects.filter(
+                        **{f"{field.m2m_field_name()}_id__in": [movie.id for movie in movies]}
+                    ).delete()
+                    links = [
+                        through(
+                            **{
+                                f"{field.m2m_field_name()}_id": int(movie_id),
+                                f"{field.m2m_reverse_field_name()}_id": related_id,
+                            }
+                        )
+                        for movie_id, data in zip(batch["id"], batch[column])
+                        for related_id in self._relation_ids(data, known_ids[relation])
+                    ]
+                    through.objects.bulk_create(links, ignore_conflicts=True, batch_size=batch_size)
+            count += len(batch)
+            rate = count / (time.perf_counter() - start)
+            print(f"saving {count} records of {total_movies} ({rate:.0f} rows/s)")
+
+        elapsed = time.perf_counter() - start
+        print(f"Task finish: {count} movies in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)")
+
+    def _incremental_update_movies(self, movies_data, batch_size):
+        movies_data = movies_data[movies_data["id"].notna()]
+        new_hashes = dict(zip(movies_data["id"].astype(int), self._content_hashes(movies_data)))
+        stored_hashes = dict(Movie.objects.values_list("id", "content_hash"))
+
+        added = sorted(id for id in new_hashes if id not in stored_hashes)
+        changed = sorted(
+            id for id, hash in new_hashes.items() if id in stored_hashes and stored_hashes[id] != hash
+        )
+        deleted = sorted(id for id in stored_hashes if id not in new_hashes)
+        print(f"{len(added)} added, {len(changed)} changed, {len(deleted)} deleted movies")
+
+        for batch_start in range(0, len(deleted), batch_size):
+            Movie.objects.filter(id__in=deleted[batch_start : batch_start + batch_size]).delete()
+        self._bulk_create_movies(movies_data[movies_data["id"].astype(int).isin(added + changed)], batch_size)
+        return {"added": added, "changed": changed, "deleted": deleted}
+
+    @staticmethod
+    def _write_changeset(changeset, path):
+        from django.conf import settings
+
+        created_at = datetime.now(timezone.utc)
+        if path is None:
+            os.makedirs(settings.CATALOGUE_CHANGESET_DIR, exist_ok=True)
+            path = os.path.join(settings.CATALOGUE_CHANGESET_DIR, f"{created_at:%Y%m%dT%H%M%S%f}.json")
+        with open(path, "w") as file:
+            json.dump({"created_at": created_at.isoformat(), **changeset}, file)
+        return path
+
     def handle(self, *args, **options):
         from django.conf import settings
 
@@ -94,4 +234,21 @@ class Command(BaseCommand):
 
         self._create_providers(providers_data)
         self._create_genres(genres_data)
-        self._create_movies(movies_data)
+        if options["incremental"]:
+            # Deletes, upserts and the changeset land together: a failed import leaves the movies
+            # as they were and reports nothing, and a written changeset matches committed rows
+            path = None
+            try:
+                with transaction.atomic():
+                    changeset = self._incremental_update_movies(movies_data, options["batch_size"])
+                    path = self._write_changeset(changeset, options["changeset"])
+            except BaseException:
+                if path is not None:
+                    os.remove(path)
+                raise
+            print(f"Changeset written to {path}")
+        elif options["bulk"]:
+            self._bulk_create_movies(movies_data, options["batch_size"])
+        else:
+            self._create_movies(movies_data)
+        bump_catalogue_version()
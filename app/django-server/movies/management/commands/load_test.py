@@ -0,0 +1,376 @@
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...synthetic import FILTERS, generate_catalogue
+
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, np.inf]
+PAYLOAD_KINDS = ("filter", "seed", "filtered_seed")
+
+SETTINGS_TEMPLATE = """from {base} import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1"]
+DATABASES = {{"default": {{"ENGINE": "django.db.backends.sqlite3", "NAME": {database!r}}}}}
+STATIC_DIR = {directory!r}
+RECOMMENDER_SOUP_DATA = {soup_data!r}
+RECOMMENDER_MODEL_DIR = {model!r}
+CATALOGUE_VERSION_FILE = {version!r}
+CATALOGUE_CHANGESET_DIR = {changesets!r}
+"""
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LoadClient:
+    """Posts JSON bodies to ``path`` over a new connection per request.
+
+    Keep-alive requests to Django's runserver stall about 40 ms each on Nagle's algorithm and
+    delayed ACKs, which would be measured as server time. A fresh loopback connection costs
+    well under a millisecond, and both servers are measured the same way.
+    """
+
+    def __init__(self, port, path, timeout=30):
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+
+    def post(self, body):
+        """Status code of the response, 0 when the request failed."""
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+        try:
+            connection.request(
+                "POST", self.path, body, {"Content-Type": "application/json", "Connection": "close"}
+            )
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            return 0
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the app from a seeded SQLite database through the WSGI and ASGI entry points and "
+        "replay a mix of filter and seed payloads, reporting throughput, latency and errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=10000, help="Movies of the synthetic catalogue.")
+        parser.add_argument(
+            "--work-dir",
+            default=None,
+            help="Keeps the seeded database, catalogue and model; reused when already seeded.",
+        )
+        parser.add_argument("--servers", default="wsgi,asgi", help="Comma separated: wsgi, asgi.")
+        parser.add_argument("--wsgi-path", default="/filter-movie/")
+        parser.add_argument("--asgi-path", default="/async/filter-movie/")
+        parser.add_argument(
+            "--mix",
+            default="filter=5,seed=3,filtered_seed=2",
+            help=f"Relative weights of the payload kinds: {', '.join(PAYLOAD_KINDS)}.",
+        )
+        parser.add_argument("--seeds", type=int, default=3, help="Seed movies per seed payload.")
+        parser.add_argument("--n-movies", type=int, default=10)
+        parser.add_argument("--duration", type=float, default=30, help="Seconds of load per server.")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Requests in flight in closed loop, or the most requests in flight in open loop.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help="Open loop: Poisson arrivals per second, whatever the response times.",
+        )
+        parser.add_argument("--warmup", type=int, default=20, help="Untimed requests before the run.")
+        parser.add_argument(
+            "--no-cache", action="store_true", help="Disable the response and score caches of the server."
+        )
+        parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+
+    @staticmethod
+    def _mix(value):
+        weights = {}
+        for item in value.split(","):
+            kind, _, weight = item.partition("=")
+            if kind not in PAYLOAD_KINDS:
+                raise CommandError(
+                    f"Unknown payload kind {kind!r}, expected one of {', '.join(PAYLOAD_KINDS)}"
+                )
+            weights[kind] = float(weight or 1)
+        return weights
+
+    def _seed(self, directory, options):
+        """Settings module serving a synthetic catalogue from ``directory``, seeding it if needed."""
+        paths = {
+            "database": os.path.join(directory, "db.sqlite3"),
+            "directory": directory,
+            "soup_data": os.path.join(directory, "soup_data.parquet"),
+            "model": os.path.join(directory, "model"),
+            "version": os.path.join(directory, "catalogue_version"),
+            "changesets": os.path.join(directory, "changesets"),
+        }
+        settings_source = SETTINGS_TEMPLATE.format(base=settings.SETTINGS_MODULE, **paths)
+        if options["no_cache"]:
+            settings_source += "FILTER_CACHE_SIZE = 0\nRECOMMENDER_SCORE_CACHE_BYTES = 0\n"
+        with open(os.path.join(directory, "load_test_settings.py"), "w") as file:
+            file.write(settings_source)
+
+        environment = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "load_test_settings",
+            "PYTHONPATH": os.pathsep.join(filter(None, [directory, os.environ.get("PYTHONPATH")])),
+        }
+        if os.path.exists(paths["database"]):
+            print(f"Reusing the catalogue seeded in {directory}")
+            return environment
+
+        print(f"Seeding {options['size']} movies into {paths['database']}")
+        generate_catalogue(directory, options["size"])
+        for command in (
+            ["migrate", "--verbosity", "0"],
+            ["import_movie_data", "--bulk"],
+            # With the default neighbour tables, so few-seed requests take the production path
+            ["build_recommender_model"],
+        ):
+            subprocess.run(
+                [sys.executable, "manage.py", *command],
+                cwd=settings.BASE_DIR,
+                env=environment,
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+        return environment
+
+    def _payloads(self, directory, options, count):
+        ids = pd.read_parquet(os.path.join(directory, "app_data.parquet"), columns=["id"])["id"].to_numpy()
+        mix = self._mix(options["mix"])
+        rng = np.random.default_rng(0)
+        kinds = rng.choice(list(mix), size=count, p=np.array(list(mix.values())) / sum(mix.values()))
+        payloads = []
+        for kind in kinds:
+            payload = {}
+            if kind != "seed":
+                payload.update(FILTERS[rng.integers(len(FILTERS))])
+            if kind != "filter":
+                payload["ids"] = rng.choice(ids, options["seeds"], replace=False).tolist()
+                payload["n_movies"] = options["n_movies"]
+            payloads.append(json.dumps(payload))
+        return payloads
+
+    @staticmethod
+    def _server_command(server, port):
+        if server == "wsgi":
+            # Django's threaded wsgiref server, serving settings.WSGI_APPLICATION (flickpicks/wsgi.py)
+            return [sys.executable, "manage.py", "runserver", "--noreload", f"127.0.0.1:{port}"]
+        return [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "flickpicks.asgi:application",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--no-access-log",
+        ]
+
+    @staticmethod
+    def _wait_until_listening(process, port, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"The server exited with status {process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f"The server did not listen on port {port} within {timeout}s")
+
+    @staticmethod
+    def _closed_loop(client, payloads, concurrency, duration):
+        """``concurrency`` workers each sending their next request once the previous one completes."""
+        results = []
+        deadline = time.perf_counter() + duration
+        payload_iterator = iter(payloads)
+        lock = threading.Lock()
+
+        def worker():
+            while time.perf_counter() < deadline:
+                with lock:
+                    body = next(payload_iterator, None)
+                if body is None:
+                    return
+                start = time.perf_counter()
+                status = client.post(body)
+                results.append((status, time.perf_counter() - start))
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    @staticmethod
+    def _open_loop(client, payloads, concurrency, duration, rate):
+        """Requests sent at Poisson arrival times whether or not earlier ones have completed.
+
+        Latency is measured from the scheduled arrival, so time spent queued for a free
+        connection counts against the server instead of being hidden (coordinated omission).
+        """
+        results = []
+        rng = np.random.default_rng(1)
+        arrivals = np.cumsum(rng.exponential(1 / rate, size=int(rate * duration * 1.5) + 1))
+        arrivals = arrivals[arrivals < duration]
+
+        def send(body, scheduled):
+            status = client.post(body)
+            results.append((status, time.perf_counter() - scheduled))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            for body, arrival in zip(payloads, arrivals):
+                delay = start + arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, body, start + arrival)
+        return results
+
+    @staticmethod
+    def _summary(results, elapsed):
+        statuses = Counter(status for status, _ in results)
+        latencies = np.array([latency for _, latency in results]) * 1000
+        errors = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+        counts, _ = np.histogram(latencies, bins=[0, *HISTOGRAM_BUCKETS_MS])
+        return {
+            "requests": len(results),
+            "seconds": elapsed,
+            "throughput": len(results) / elapsed,
+            "errors": errors,
+            "error_rate": errors / max(len(results), 1),
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "latency_ms": {
+                name: float(np.percentile(latencies, percentile)) if len(latencies) else None
+                for name, percentile in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+            },
+            "histogram_ms": {
+                f"<={bucket}" if np.isfinite(bucket) else f">{HISTOGRAM_BUCKETS_MS[-2]}": int(count)
+                for bucket, count in zip(HISTOGRAM_BUCKETS_MS, counts)
+            },
+        }
+
+    def _report(self, server, summary):
+        latency = summary["latency_ms"]
+        print(
+            f"{server}: {summary['requests']} requests in {summary['seconds']:.1f}s, "
+            f"{summary['throughput']:.1f} req/s, {summary['errors']} errors ({summary['error_rate']:.2%})"
+        )
+        if summary["requests"]:
+            print(
+                f"  latency ms: p50 {latency['p50']:.2f}, p90 {latency['p90']:.2f}, "
+                f"p99 {latency['p99']:.2f}, max {latency['max']:.2f}"
+            )
+        print(f"  statuses: {summary['statuses']}")
+        peak = max(summary["histogram_ms"].values()) or 1
+        for bucket, count in summary["histogram_ms"].items():
+            print(f"  {bucket:>8} ms {count:>8}  {'#' * round(40 * count / peak)}")
+
+    def _run_server(self, server, directory, environment, payloads, options):
+        port = _free_port()
+        path = options["wsgi_path"] if server == "wsgi" else options["asgi_path"]
+        with open(os.path.join(directory, f"{server}.log"), "w") as log:
+            process = subprocess.Popen(
+                self._server_command(server, port),
+                cwd=settings.BASE_DIR,
+                env=environment,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+            try:
+                self._wait_until_listening(process, port)
+                client = LoadClient(port, path)
+                for body in payloads[: options["warmup"]]:
+                    client.post(body)
+                payloads = payloads[options["warmup"] :]
+
+                start = time.perf_counter()
+                if options["rate"]:
+                    results = self._open_loop(
+                        client, payloads, options["concurrency"], options["duration"], options["rate"]
+                    )
+                else:
+                    results = self._closed_loop(client, payloads, options["concurrency"], options["duration"])
+                return self._summary(results, time.perf_counter() - start)
+            finally:
+                process.terminate()
+                process.wait()
+
+    def _run(self, directory, options):
+        environment = self._seed(directory, options)
+        # More payloads than the servers can plausibly answer within the duration
+        count = options["warmup"] + int(max(options["rate"] or 0, 2000) * options["duration"] * 1.5)
+        payloads = self._payloads(directory, options, count)
+
+        mode = f"open loop at {options['rate']} req/s" if options["rate"] else "closed loop"
+        print(f"{mode}, concurrency {options['concurrency']}, {options['duration']}s per server")
+        results = {}
+        for server in options["servers"].split(","):
+            results[server] = self._run_server(server, directory, environment, payloads, options)
+            self._report(server, results[server])
+        return results
+
+    def handle(self, *args, **options):
+        # Fail on bad arguments before spending time on seeding
+        self._mix(options["mix"])
+        for server in options["servers"].split(","):
+            if server not in ("wsgi", "asgi"):
+                raise CommandError(f"Unknown server {server!r}, expected wsgi or asgi")
+            if server == "asgi" and importlib.util.find_spec("uvicorn") is None:
+                raise CommandError("uvicorn is not installed, see requirements.txt, or use --servers wsgi")
+
+        if options["work_dir"]:
+            os.makedirs(options["work_dir"], exist_ok=True)
+            results = self._run(os.path.abspath(options["work_dir"]), options)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                results = self._run(directory, options)
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(
+                    {
+                        "options": {
+                            key: options[key]
+                            for key in ("size", "mix", "seeds", "n_movies", "duration", "concurrency", "rate")
+                        },
+                        "servers": results,
+                    },
+                    file,
+                    indent=2,
+                )
+            print(f"Results written to {options['output']}")
@@ -0,0 +1,68 @@
+import json
+import os
+import time
+
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...backends import IVFIndex
+from ...catalogue import bump_catalogue_version
+from ...recommender import RecommenderModel, update_model
+
+
+class Command(BaseCommand):
+    help = "Apply import_movie_data changesets to the persisted recommender model in place."
+
+    def add_arguments(self, parser):
+        parser.add_argument("changesets", nargs="+", help="Changeset JSON files, oldest first.")
+        parser.add_argument("--soup-data", default=settings.RECOMMENDER_SOUP_DATA)
+        parser.add_argument("--model", default=settings.RECOMMENDER_MODEL_DIR)
+        parser.add_argument("--jobs", type=int, default=-1, help="Worker processes for the neighbour patch.")
+
+    @staticmethod
+    def _merge_changesets(paths):
+        upserted = set()
+        deleted = set()
+        for path in paths:
+            with open(path) as file:
+                changeset = json.load(file)
+            changed = set(changeset["added"]) | set(changeset["changed"])
+            upserted = (upserted | changed) - set(changeset["deleted"])
+            deleted = (deleted | set(changeset["deleted"])) - changed
+        return upserted, deleted
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        upserted, deleted = self._merge_changesets(options["changesets"])
+        soup_data = (
+            pd.read_parquet(
+                options["soup_data"],
+                columns=["id", "soup_plot", "soup_general"],
+                filters=[("id", "in", sorted(upserted))],
+            )
+            if upserted
+            else pd.DataFrame(columns=["id", "soup_plot", "soup_general"])
+        )
+        missing = upserted - set(soup_data["id"].tolist())
+        if missing:
+            print(f"{len(missing)} upserted movies have no soup and are skipped: {sorted(missing)[:10]}")
+
+        model = RecommenderModel.load(options["model"])
+        updated, old_rows = update_model(model, soup_data, sorted(deleted), options["jobs"])
+        attachments = {}
+        index_directory = os.path.join(model.directory, "ivf")
+        if IVFIndex.exists(index_directory):
+            index = IVFIndex.load(index_directory)
+            if len(index.order) == len(model):
+                attachments["ivf"] = index.update(updated, old_rows)
+            else:
+                print(f"Dropping the IVF index of {index_directory}, built for another catalogue")
+        updated.save(options["model"], attachments)
+        bump_catalogue_version()
+
+        elapsed = time.perf_counter() - start
+        print(
+            f"{len(soup_data)} movies upserted and {len(model.rows(sorted(deleted)))} deleted, "
+            f"model now has {len(updated)} movies ({elapsed:.1f}s)"
+        )
@@ -0,0 +1,50 @@
+from movies.profiling import phase
+from prometheus_client import Counter, Gauge, Histogram
+from rest_framework.renderers import JSONRenderer
+
+# Latency buckets in seconds, from sub-millisecond index lookups to slow ORM fallbacks
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+FILTER_SECONDS = Histogram(
+    "flickpicks_filter_seconds",
+    "Time spent selecting the movies matching the request filters.",
+    ["source"],
+    buckets=LATENCY_BUCKETS,
+)
+FILTER_ERRORS = Counter(
+    "flickpicks_filter_errors_total", "Filters the ORM rejected, answered with no movies."
+)
+CANDIDATES = Histogram(
+    "flickpicks_candidates",
+    "Movies left after filtering, the candidates of the recommendations.",
+    buckets=(0, 10, 100, 1000, 10000, 100000, 1000000),
+)
+SCORING_SECONDS = Histogram(
+    "flickpicks_scoring_seconds", "Time spent ranking candidates for a seed set.", buckets=LATENCY_BUCKETS
+)
+SERIALISATION_SECONDS = Histogram(
+    "flickpicks_serialisation_seconds", "Time spent rendering response bodies.", buckets=LATENCY_BUCKETS
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "flickpicks_model_load_seconds", "Time the current recommender model took to load."
+)
+MODEL_BYTES = Gauge(
+    "flickpicks_model_bytes",
+    "Size of the current recommender model arrays; memory-mapped arrays count their mapped size.",
+    ["part"],
+)
+MODEL_MOVIES = Gauge("flickpicks_model_movies", "Movies in the current recommender model.")
+
+
+def observe_model(model, load_seconds=None):
+    if load_seconds is not None:
+        MODEL_LOAD_SECONDS.set(load_seconds)
+    for part, nbytes in model.nbytes().items():
+        MODEL_BYTES.labels(part).set(nbytes)
+    MODEL_MOVIES.set(len(model))
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase("render"), SERIALISATION_SECONDS.time():
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("movies", "0002_remove_movie_actors_movie_streaming_delete_actors_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movie",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+    ]
@@ -28,3 +28,4 @@ class Movie(models.Model):
     streaming = models.ManyToManyField(to=Providers, related_name="streaming_provider")
     buy = models.ManyToManyField(to=Providers, related_name="buy_provider")
     rent = models.ManyToManyField(to=Providers, related_name="rent_provider")
+    content_hash = models.CharField(max_length=32, blank=True, default="")
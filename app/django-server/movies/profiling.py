@@ -0,0 +1,141 @@
+import contextlib
+import contextvars
+import cProfile
+import os
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time the block as the ``name`` phase of the current request, summing repeated phases.
+
+    A no-op outside ``ServerTimingMiddleware``, and in threads the request context was not
+    copied to, like the scoring executor of the async view.
+    """
+    timings = _timings.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+def server_timing(timings, total):
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.2f}" for name, seconds in [*timings.items(), ("total", total)]
+    )
+
+
+class ProfileStore:
+    """Directory of captured profiles keeping the ``keep`` newest files."""
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()
+
+    def path(self, request, elapsed, suffix):
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+        name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{request.method}-{slug}-{elapsed * 1000:.0f}ms{suffix}"
+        return os.path.join(self.directory, name)
+
+    def rotate(self):
+        with self.lock:
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+            paths.sort(key=os.path.getmtime)
+            for path in paths[: max(len(paths) - self.keep, 0)]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+
+class ServerTimingMiddleware:
+    """Adds a ``Server-Timing`` header with the phases timed by ``phase`` and the total.
+
+    With ``REQUEST_PROFILING`` on, synchronously served requests are also profiled: one in
+    ``REQUEST_PROFILE_SAMPLE_RATE``, and every request slower than ``REQUEST_PROFILE_SLOW_MS``.
+    Catching slow requests means profiling all of them and keeping the slow ones, so it costs
+    the cProfile overhead on every request. ``REQUEST_PROFILE_MEMORY`` adds a tracemalloc
+    snapshot of one request at a time. Profiles are written to ``REQUEST_PROFILE_DIR``, which
+    keeps the ``REQUEST_PROFILE_KEEP`` newest files.
+    """
+
+    sync_capable = True
+    async_capable = True
+    # Only one request can own tracemalloc's process-wide tracing at a time
+    memory_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.requests = 0
+        self.store = None
+        if settings.REQUEST_PROFILING:
+            os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+            self.store = ProfileStore(settings.REQUEST_PROFILE_DIR, settings.REQUEST_PROFILE_KEEP)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        self.requests += 1
+        rate = settings.REQUEST_PROFILE_SAMPLE_RATE
+        return bool(rate) and self.requests % rate == 0
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = {}
+        token = _timings.set(timings)
+        sampled = self.store is not None and self._sampled()
+        slow_ms = settings.REQUEST_PROFILE_SLOW_MS if self.store is not None else None
+        profiler = cProfile.Profile() if sampled or slow_ms is not None else None
+        memory = sampled and settings.REQUEST_PROFILE_MEMORY and self.memory_lock.acquire(blocking=False)
+        try:
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            elapsed = time.perf_counter() - start
+
+            if sampled or (slow_ms is not None and elapsed * 1000 >= slow_ms):
+                # Snapshot first, so that the allocations of dump_stats are not in it
+                if memory:
+                    tracemalloc.take_snapshot().dump(self.store.path(request, elapsed, ".tracemalloc"))
+                profiler.dump_stats(self.store.path(request, elapsed, ".prof"))
+                self.store.rotate()
+        finally:
+            if memory:
+                tracemalloc.stop()
+                self.memory_lock.release()
+            _timings.reset(token)
+
+        response["Server-Timing"] = server_timing(timings, elapsed)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile would attribute the other coroutines interleaved on the loop to this request
+        timings = {}
+        token = _timings.set(timings)
+        try:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            elapsed = time.perf_counter() - start
+        finally:
+            _timings.reset(token)
+        response["Server-Timing"] = server_timing(timings, elapsed)
+        return response
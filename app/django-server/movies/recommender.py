@@ -0,0 +1,528 @@
+import functools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from joblib import Parallel, delayed, effective_n_jobs
+from movies.catalogue import atomic_write, catalogue_version
+from movies.metrics import observe_model
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+SPACES = ("plot", "general")
+
+
+class RecommenderModel:
+    """Fitted vocabularies and L2-normalised soup matrices, one row per movie.
+
+    ``neighbours`` optionally maps each space to an ``(indices, scores)`` pair of N x K
+    int32/float32 arrays holding every movie's K most similar rows, best first.
+
+    Saved models are flat ``.npy`` arrays (CSR data/indices/indptr, id maps, neighbours) that
+    ``load`` memory-maps read-only, so every worker process shares one page-cache copy.
+    ``vocabularies`` may be a callable returning them, called on first use.
+    """
+
+    def __init__(self, ids, matrices, vocabularies, neighbours=None, id_map=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.matrices = matrices
+        self._vocabularies = vocabularies
+        self.neighbours = neighbours
+        # Where the model was saved or loaded from, None until then
+        self.directory = None
+        if id_map is None:
+            order = np.argsort(self.ids, kind="stable")
+            id_map = (order, self.ids[order])
+        self._order, self._sorted_ids = id_map
+
+    @property
+    def vocabularies(self):
+        if callable(self._vocabularies):
+            self._vocabularies = self._vocabularies()
+        return self._vocabularies
+
+    @property
+    def plot_matrix(self):
+        return self.matrices["plot"]
+
+    @property
+    def general_matrix(self):
+        return self.matrices["general"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, ids):
+        """Matrix rows of the given movie ids, dropping ids the model does not know."""
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if not len(self) or not len(ids):
+            return np.empty(0, dtype=np.intp)
+        positions = np.searchsorted(self._sorted_ids, ids).clip(max=len(self) - 1)
+        return self._order[positions[self._sorted_ids[positions] == ids]]
+
+    def nbytes(self):
+        """Bytes of the model arrays: the soup matrices, the id maps and the neighbour tables."""
+        matrices = sum(
+            matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+            for matrix in self.matrices.values()
+        )
+        neighbours = sum(
+            indices.nbytes + scores.nbytes for indices, scores in (self.neighbours or {}).values()
+        )
+        ids = self.ids.nbytes + self._order.nbytes + self._sorted_ids.nbytes
+        return {"matrices": matrices, "ids": ids, "neighbours": neighbours}
+
+    def mask(self, ids):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.rows(ids)] = True
+        return mask
+
+    @classmethod
+    def build(cls, soup_data):
+        matrices = {}
+        vocabularies = {}
+        for space in SPACES:
+            count_vectorizer = CountVectorizer(stop_words="english", dtype=np.float32)
+            matrix = count_vectorizer.fit_transform(soup_data[f"soup_{space}"])
+            matrices[space] = normalize(matrix).tocsr()
+            vocabularies[space] = {term: int(index) for term, index in count_vectorizer.vocabulary_.items()}
+        return cls(soup_data["id"].to_numpy(), matrices, vocabularies)
+
+    def build_neighbours(self, k=200, n_jobs=-1):
+        self.neighbours = {space: build_neighbours(self.matrices[space], k, n_jobs) for space in SPACES}
+
+    def vectorizer(self, space):
+        return CountVectorizer(stop_words="english", dtype=np.float32, vocabulary=self.vocabularies[space])
+
+    def save(self, directory, attachments=None):
+        """Publish the model as a new generation of ``directory``.
+
+        The files are written to a temporary directory that is renamed into place, then the
+        ``CURRENT`` file is switched to it, so a loading process reads either the previous model
+        or this one in full. ``attachments`` maps subdirectory names to objects with a ``save``
+        method, like the IVF index, published together with the model. The previous generation
+        is kept for processes still loading it, older ones are removed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        previous = _current_generation(directory)
+        temporary = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+        try:
+            os.chmod(temporary, 0o755)
+            self._write(temporary)
+            for name, attachment in (attachments or {}).items():
+                attachment.save(os.path.join(temporary, name))
+            generation = f"model-{time.time_ns()}"
+            os.rename(temporary, os.path.join(directory, generation))
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        atomic_write(os.path.join(directory, "CURRENT"), lambda file: file.write(generation), mode="w")
+        self.directory = os.path.join(directory, generation)
+        for name in os.listdir(directory):
+            if name.startswith("model-") and name not in (generation, previous):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def _write(self, directory):
+        arrays = {"ids": self.ids, "id_order": self._order, "sorted_ids": self._sorted_ids}
+        shapes = {}
+        for space in SPACES:
+            matrix = self.matrices[space].copy()
+            # Canonical CSR, so scipy never needs to sort the read-only arrays after loading
+            matrix.sum_duplicates()
+            arrays.update(
+                {
+                    f"{space}_data": matrix.data,
+                    f"{space}_indices": matrix.indices,
+                    f"{space}_indptr": matrix.indptr,
+                }
+            )
+            shapes[space] = matrix.shape
+        for space, (indices, scores) in (self.neighbours or {}).items():
+            arrays.update({f"{space}_neighbours": indices, f"{space}_neighbour_scores": scores})
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, "matrices.json"), "w") as file:
+            json.dump(shapes, file)
+        with open(os.path.join(directory, "vocabulary.json"), "w") as file:
+            json.dump(self.vocabularies, file)
+
+    @staticmethod
+    def path(directory):
+        """Directory holding the files of the model published in ``directory``.
+
+        Models saved before generations were introduced keep their files in ``directory``.
+        """
+        generation = _current_generation(directory)
+        return directory if generation is None else os.path.join(directory, generation)
+
+    @classmethod
+    def load(cls, directory):
+        if not cls.exists(directory):
+            raise FileNotFoundError(f"No recommender model in {directory}, run build_recommender_model")
+        directory = cls.path(directory)
+        array = functools.partial(_mapped, directory)
+        neighbours = None
+        if os.path.exists(os.path.join(directory, "plot_neighbours.npy")):
+            neighbours = {
+                space: (array(f"{space}_neighbours"), array(f"{space}_neighbour_scores")) for space in SPACES
+            }
+        if not os.path.exists(os.path.join(directory, "matrices.json")):
+            model = cls._load_npz(directory, neighbours)
+        else:
+            model = cls._load_arrays(directory, neighbours)
+        if model.neighbours is not None and any(
+            len(indices) != len(model) for indices, _ in model.neighbours.values()
+        ):
+            logger.warning(
+                "Ignoring the neighbour tables of %s, they do not match the model's movies", directory
+            )
+            model.neighbours = None
+        model.directory = directory
+        return model
+
+    @classmethod
+    def _load_arrays(cls, directory, neighbours):
+        array = functools.partial(_mapped, directory)
+        with open(os.path.join(directory, "matrices.json")) as file:
+            shapes = json.load(file)
+        matrices = {}
+        for space in SPACES:
+            matrix = sparse.csr_matrix(
+                (array(f"{space}_data"), array(f"{space}_indices"), array(f"{space}_indptr")),
+                shape=tuple(shapes[space]),
+                copy=False,
+            )
+            matrix.has_canonical_format = True
+            matrices[space] = matrix
+        vocabularies = functools.partial(_read_json, os.path.join(directory, "vocabulary.json"))
+        return cls(array("ids"), matrices, vocabularies, neighbours, (array("id_order"), array("sorted_ids")))
+
+    @classmethod
+    def _load_npz(cls, directory, neighbours):
+        """Model saved in the former layout, with one compressed ``.npz`` per matrix."""
+        matrices = {
+            space: sparse.load_npz(os.path.join(directory, f"{space}_matrix.npz")).tocsr() for space in SPACES
+        }
+        vocabularies = _read_json(os.path.join(directory, "vocabulary.json"))
+        return cls(np.load(os.path.join(directory, "ids.npy")), matrices, vocabularies, neighbours)
+
+    @classmethod
+    def exists(cls, directory):
+        return os.path.exists(os.path.join(cls.path(directory), "vocabulary.json"))
+
+
+def _current_generation(directory):
+    try:
+        with open(os.path.join(directory, "CURRENT")) as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _mapped(directory, name):
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+
+def _read_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def _select_top_k(indices, scores, k):
+    """Best ``k`` entries of every row, best first; missing entries are -1 with score -inf."""
+    if scores.shape[1] < k:
+        padding = ((0, 0), (0, k - scores.shape[1]))
+        indices = np.pad(indices, padding, constant_values=-1)
+        scores = np.pad(scores, padding, constant_values=-np.inf)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_scores = np.take_along_axis(best_scores, order, axis=1).astype(np.float32)
+    best_indices = np.take_along_axis(np.take_along_axis(indices, best, axis=1), order, axis=1).astype(
+        np.int32
+    )
+    best_indices[np.isneginf(best_scores)] = -1
+    return best_indices, best_scores
+
+
+def _chunk_top_k(matrix, rows, k):
+    similarity = (matrix[rows] @ matrix.T).toarray()
+    similarity[np.arange(len(rows)), rows] = -np.inf
+    return _select_top_k(np.broadcast_to(np.arange(matrix.shape[0]), similarity.shape), similarity, k)
+
+
+def _chunk_size(n_columns, chunk_cells):
+    return max(1, chunk_cells // max(n_columns, 1))
+
+
+def build_neighbours(matrix, k=200, n_jobs=-1, chunk_cells=2**24):
+    """Top-k most similar rows of every row, excluding itself.
+
+    Rows are processed in chunks sized so each dense similarity block holds about
+    ``chunk_cells`` values, and chunks are spread over ``n_jobs`` worker processes.
+    """
+    rows = np.arange(matrix.shape[0])
+    return _build_neighbours(matrix, rows, min(k, matrix.shape[0] - 1), n_jobs, chunk_cells)
+
+
+def _build_neighbours(matrix, rows, k, n_jobs=-1, chunk_cells=2**24):
+    chunk_size = _chunk_size(matrix.shape[0], chunk_cells)
+    chunks = Parallel(n_jobs=n_jobs)(
+        delayed(_chunk_top_k)(matrix, rows[start : start + chunk_size], k)
+        for start in range(0, len(rows), chunk_size)
+    )
+    if not chunks:
+        return np.empty((0, k), dtype=np.int32), np.empty((0, k), dtype=np.float32)
+    indices, scores = zip(*chunks)
+    return np.vstack(indices), np.vstack(scores)
+
+
+def _patch_neighbours(neighbours, matrix, old_rows, n_jobs=-1, chunk_cells=2**24):
+    """Neighbour tables of ``matrix`` whose first rows are the old rows ``old_rows``.
+
+    Rows after ``len(old_rows)`` are new or re-vectorised and get fresh lists, as do kept
+    rows whose list pointed at a removed row. Every other kept row only merges in its
+    scores against the new rows, since no row outside its old list can have moved up.
+    """
+    indices, scores = neighbours
+    k = indices.shape[1]
+    n_kept = len(old_rows)
+    n_rows = matrix.shape[0]
+
+    # One extra slot so that -1 entries, which index the last element, stay -1.
+    old_to_new = np.full(len(indices) + 1, -1, dtype=np.int64)
+    old_to_new[old_rows] = np.arange(n_kept)
+    old_indices = np.asarray(indices[old_rows])
+    kept_indices = old_to_new[old_indices]
+    kept_scores = np.where(kept_indices >= 0, np.asarray(scores[old_rows]), -np.inf).astype(np.float32)
+
+    touched = matrix[n_kept:]
+    touched_rows = np.arange(n_kept, n_rows)
+    patched = []
+    chunk_size = _chunk_size(len(touched_rows), chunk_cells)
+    for start in range(0, n_kept, chunk_size):
+        stop = min(start + chunk_size, n_kept)
+        touched_scores = (matrix[start:stop] @ touched.T).toarray()
+        patched.append(
+            _select_top_k(
+                np.hstack([kept_indices[start:stop], np.broadcast_to(touched_rows, touched_scores.shape)]),
+                np.hstack([kept_scores[start:stop], touched_scores]),
+                k,
+            )
+        )
+    patched.append(_build_neighbours(matrix, touched_rows, k, n_jobs, chunk_cells))
+    indices, scores = (np.vstack(arrays) for arrays in zip(*patched))
+
+    lost = np.flatnonzero(((kept_indices < 0) & (old_indices >= 0)).any(axis=1))
+    indices[lost], scores[lost] = _build_neighbours(matrix, lost, k, n_jobs, chunk_cells)
+    return indices, scores
+
+
+def update_model(model, soup_data, deleted_ids=(), n_jobs=-1):
+    """Model with the soups in ``soup_data`` upserted and ``deleted_ids`` removed.
+
+    Upserted rows are vectorised with the model's frozen vocabularies, so terms that are new
+    to the catalogue are ignored until the next full build. Returns the updated model and,
+    for each of its leading rows, the row it had in ``model``; upserted rows come last.
+    """
+    upserted_ids = soup_data["id"].to_numpy(dtype=np.int64)
+    removed = model.mask(np.concatenate([upserted_ids, np.asarray(deleted_ids, dtype=np.int64)]))
+    old_rows = np.flatnonzero(~removed)
+
+    matrices = {}
+    for space in SPACES:
+        upserted = model.vectorizer(space).transform(soup_data[f"soup_{space}"])
+        # normalize rejects empty matrices, which changesets holding only deletes produce
+        upserted = normalize(upserted) if upserted.shape[0] else upserted
+        matrices[space] = sparse.vstack([model.matrices[space][old_rows], upserted], format="csr")
+    updated = RecommenderModel(
+        np.concatenate([model.ids[old_rows], upserted_ids]), matrices, model.vocabularies
+    )
+    if model.neighbours is not None:
+        updated.neighbours = {
+            space: _patch_neighbours(model.neighbours[space], matrices[space], old_rows, n_jobs)
+            for space in SPACES
+        }
+    return updated, old_rows
+
+
+_model = None
+_model_version = None
+_model_lock = threading.Lock()
+
+
+def _stale(model, version):
+    return model is None or _model_version != version
+
+
+def get_model():
+    """Model published in ``RECOMMENDER_MODEL_DIR``, loaded again once the catalogue version
+    changed and another model was published, or None while no model was built."""
+    global _model, _model_version
+    if not RecommenderModel.exists(settings.RECOMMENDER_MODEL_DIR):
+        return _model
+    version = catalogue_version()
+    if _stale(_model, version):
+        with _model_lock:
+            if _stale(_model, version):
+                directory = RecommenderModel.path(settings.RECOMMENDER_MODEL_DIR)
+                # An import bumps the version too, without touching the model
+                if _model is None or _model.directory != directory:
+                    start = time.perf_counter()
+                    _model = RecommenderModel.load(settings.RECOMMENDER_MODEL_DIR)
+                    observe_model(_model, time.perf_counter() - start)
+                _model_version = version
+    return _model
+
+
+def set_model(model):
+    global _model, _model_version
+    with _model_lock:
+        _model = model
+        _model_version = catalogue_version()
+        if model is not None:
+            observe_model(model)
+
+
+def score(model, rows, weight_plot=0.7, candidates=None, cache=None):
+    """Mean blended similarity of the candidate rows (all movies by default) to the seed rows.
+
+    Averaging ``P[rows] @ P.T`` over the seeds equals ``P @ mean(P[rows])``, so only one
+    sparse matrix-vector product per space is needed and nothing larger than N is allocated.
+    ``cache`` is an optional ``movies.score_cache.ScoreCache`` of per-seed vectors.
+    """
+    if cache is not None:
+        return cache.score(rows, weight_plot, candidates)
+
+    scores = np.zeros(len(model) if candidates is None else len(candidates), dtype=np.float32)
+    for space, weight in (("plot", weight_plot), ("general", 1 - weight_plot)):
+        matrix = model.matrices[space]
+        seed_vector = np.asarray(matrix[rows].mean(axis=0), dtype=np.float32).ravel()
+        target = matrix if candidates is None else matrix[candidates]
+        scores += np.float32(weight) * (target @ seed_vector)
+    return scores
+
+
+def neighbour_candidates(model, rows):
+    """Union of the seeds' plot and general neighbour lists."""
+    candidates = np.unique(
+        np.concatenate([np.asarray(model.neighbours[space][0][rows]).ravel() for space in SPACES])
+    )
+    return candidates[candidates >= 0]
+
+
+def top_n(scores, n, exclude=None):
+    scores = np.array(scores, dtype=np.float32)
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    n = min(n, int(np.isfinite(scores).sum()))
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+    best = np.argpartition(-scores, n - 1)[:n]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def _recommend_from(model, rows, candidates, excluded, weight_plot, n_movies, cache=None):
+    scores = score(model, rows, weight_plot, candidates, cache)
+    best = top_n(scores, n_movies, exclude=excluded[candidates])
+    return candidates[best] if len(best) == n_movies else None
+
+
+def _seed_matrix(rows_list, n_rows):
+    """Sparse matrix whose i-th row averages the seed rows of the i-th query."""
+    lengths = np.array([len(rows) for rows in rows_list], dtype=np.int64)
+    columns = np.concatenate([np.asarray(rows, dtype=np.int64) for rows in rows_list] or [[]])
+    weights = np.repeat(1 / np.maximum(lengths, 1), lengths).astype(np.float32)
+    query_rows = np.repeat(np.arange(len(rows_list)), lengths)
+    return sparse.csr_matrix((weights, (query_rows, columns)), shape=(len(rows_list), n_rows))
+
+
+def _batch_top_n(model, rows_list, exclude_list, weight_plot, n_movies, mask):
+    seeds = _seed_matrix(rows_list, len(model))
+    scores = np.zeros((len(rows_list), len(model)), dtype=np.float32)
+    for space, weight in (("plot", weight_plot), ("general", 1 - weight_plot)):
+        matrix = model.matrices[space]
+        queries = (seeds @ matrix).toarray()
+        scores += np.float32(weight) * (matrix @ queries.T).T
+
+    if mask is not None:
+        scores[:, ~mask] = -np.inf
+    excluded = [np.asarray(exclude, dtype=np.int64) for exclude in exclude_list]
+    query_rows = np.repeat(np.arange(len(excluded)), [len(exclude) for exclude in excluded])
+    scores[query_rows, np.concatenate(excluded or [[]]).astype(np.int64)] = -np.inf
+
+    n = min(n_movies, len(model))
+    if n <= 0:
+        return [np.empty(0, dtype=np.intp) for _ in rows_list]
+    best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return [
+        row_best[np.isfinite(row_scores)] if len(rows) else np.empty(0, dtype=np.intp)
+        for rows, row_best, row_scores in zip(rows_list, best, best_scores)
+    ]
+
+
+def recommend_batch(
+    model, rows_list, exclude_list=None, weight_plot=0.7, n_movies=10, mask=None, n_jobs=1, chunk_cells=2**24
+):
+    """Ranked rows for every seed set of ``rows_list``, yielded in order.
+
+    Queries are scored in blocks: the seeds of a block are stacked into one sparse matrix,
+    turned into dense query vectors and multiplied by the soup matrices, so each block costs
+    one sparse-dense product per space. Blocks run on ``n_jobs`` threads and are sized so that
+    the dense arrays of all running blocks, N scores and one vocabulary-wide query vector per
+    query, hold about ``chunk_cells`` values together. ``exclude_list`` defaults to each
+    query's seeds and ``mask``, when given, restricts every result to the rows where it is true.
+    """
+    exclude_list = rows_list if exclude_list is None else exclude_list
+    query_cells = len(model) + max(model.matrices[space].shape[1] for space in SPACES)
+    block_size = _chunk_size(query_cells, chunk_cells // effective_n_jobs(n_jobs))
+    blocks = Parallel(n_jobs=n_jobs, prefer="threads", return_as="generator")(
+        delayed(_batch_top_n)(
+            model,
+            rows_list[start : start + block_size],
+            exclude_list[start : start + block_size],
+            weight_plot,
+            n_movies,
+            mask,
+        )
+        for start in range(0, len(rows_list), block_size)
+    )
+    for block in blocks:
+        yield from block
+
+
+def recommend(model, rows, exclude=None, weight_plot=0.7, n_movies=10, backend=None, mask=None, cache=None):
+    """Ranked rows most similar to the seed rows, skipping ``exclude``.
+
+    ``mask`` optionally restricts the result to the rows where it is true. Requests with up
+    to ``RECOMMENDER_NEIGHBOUR_MAX_SEEDS`` seeds only score the union of the seeds'
+    neighbour lists when the model has them; other requests score the candidates proposed by
+    ``backend``. Whenever a candidate set is too small to fill ``n_movies`` the whole
+    catalogue is scored instead. ``cache`` is passed on to ``score``.
+    """
+    excluded = np.zeros(len(model), dtype=bool) if mask is None else ~mask
+    excluded[rows if exclude is None else exclude] = True
+    if model.neighbours is not None and 0 < len(rows) <= settings.RECOMMENDER_NEIGHBOUR_MAX_SEEDS:
+        candidates = neighbour_candidates(model, rows)
+        best = _recommend_from(model, rows, candidates, excluded, weight_plot, n_movies, cache)
+        if best is not None:
+            return best
+    candidates = None if backend is None else backend.candidates(rows, weight_plot)
+    if candidates is not None:
+        best = _recommend_from(model, rows, candidates, excluded, weight_plot, n_movies, cache)
+        if best is not None:
+            return best
+    return top_n(score(model, rows, weight_plot, cache=cache), n_movies, exclude=excluded)
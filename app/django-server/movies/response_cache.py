@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _canonical(value):
+    """``value`` with dict keys stringified and lists sorted, so equivalent bodies compare equal."""
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_canonical(item) for item in value]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+    return value
+
+
+def cache_key(data, version):
+    body = json.dumps(_canonical(data), sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.blake2b(f"{version}:{body}".encode(), digest_size=16).hexdigest()
+    return f"filter-movie:{digest}"
+
+
+class ResponseCache:
+    """In-process LRU of response bodies expiring after ``ttl`` seconds.
+
+    When ``backend`` (a Django cache) is given, entries are also written to it and local misses
+    are looked up there, so processes sharing the backend share their responses.
+    """
+
+    def __init__(self, max_size=1024, ttl=60, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.entries.pop(key, None)
+
+        value = self.backend.get(key) if self.backend is not None else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self._store(key, value)
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.ttl)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                alias = settings.FILTER_CACHE_ALIAS
+                _cache = ResponseCache(
+                    settings.FILTER_CACHE_SIZE,
+                    settings.FILTER_CACHE_TTL,
+                    caches[alias] if alias is not None else None,
+                )
+    return _cache
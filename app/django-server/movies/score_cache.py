@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from movies.recommender import get_model
+
+
+def seed_scores(model, rows, weight_plot=0.7):
+    """N x len(rows) blended similarity of every movie to each seed row on its own."""
+    scores = np.zeros((len(model), len(rows)), dtype=np.float32)
+    for space, weight in (("plot", weight_plot), ("general", 1 - weight_plot)):
+        matrix = model.matrices[space]
+        scores += np.float32(weight) * (matrix @ matrix[rows].T).toarray()
+    return scores
+
+
+class ScoreCache:
+    """LRU of per-seed score vectors over the whole catalogue of ``model``.
+
+    The score of several seeds is the mean of their single-seed vectors, so a popular seed is
+    scored once per ``weight_plot`` and afterwards only averaged. Vectors are kept as ``dtype``
+    and evicted once they take more than ``max_bytes``.
+    """
+
+    def __init__(self, model, max_bytes, dtype=np.float32):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, row, weight_plot):
+        return int(self.model.ids[row]), round(float(weight_plot), 6)
+
+    def _put(self, key, vector):
+        if key in self.entries or vector.nbytes > self.max_bytes:
+            return
+        self.entries[key] = vector
+        self.bytes += vector.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+
+    def score(self, rows, weight_plot=0.7, candidates=None):
+        """Same as ``recommender.score`` from cached vectors, scoring and caching the whole
+        vectors of the seeds that are missing, with or without ``candidates``."""
+        rows = np.asarray(rows)
+        keys = [self._key(row, weight_plot) for row in rows]
+        with self.lock:
+            vectors = [self.entries.get(key) for key in keys]
+            for key, vector in zip(keys, vectors):
+                if vector is not None:
+                    self.entries.move_to_end(key)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = seed_scores(self.model, rows[missing], weight_plot).astype(self.dtype)
+            with self.lock:
+                for column, i in enumerate(missing):
+                    vectors[i] = computed[:, column].copy()
+                    self._put(keys[i], vectors[i])
+        with self.lock:
+            self.hits += len(rows) - len(missing)
+            self.misses += len(missing)
+
+        scores = np.zeros(len(self.model), dtype=np.float32)
+        for vector in vectors:
+            scores += vector
+        scores /= len(rows)
+        return scores if candidates is None else scores[candidates]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_score_cache():
+    """Score cache of the current model, or None when ``RECOMMENDER_SCORE_CACHE_BYTES`` is 0 or
+    no model was built."""
+    global _cache
+    if not settings.RECOMMENDER_SCORE_CACHE_BYTES:
+        return None
+    model = get_model()
+    if model is None:
+        return None
+    if _cache is None or _cache.model is not model:
+        with _cache_lock:
+            if _cache is None or _cache.model is not model:
+                _cache = ScoreCache(
+                    model, settings.RECOMMENDER_SCORE_CACHE_BYTES, settings.RECOMMENDER_SCORE_CACHE_DTYPE
+                )
+    return _cache
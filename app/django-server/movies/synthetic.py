@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+N_GENRES = 19
+N_PROVIDERS = 30
+N_TOPICS = 50
+VOCABULARY_SIZE = 50000
+
+# Request filters over the synthetic genre and provider ids
+FILTERS = [
+    {},
+    {"genres__in": [1, 2]},
+    {"free": True},
+    {"year__gte": "2000", "streaming__in": [1, 2, 3]},
+    {"genres": 4, "rent__in": [5, 6], "year__lt": "1990"},
+    # Not indexed, answered by the ORM
+    {"title__startswith": "Movie 1"},
+]
+
+
+def _soups(rng, topics, length_range, chunk_size=10000):
+    """Space separated pseudo-words, Zipf distributed around each movie's topic."""
+    words = np.array([f"w{index}" for index in range(VOCABULARY_SIZE)])
+    stride = VOCABULARY_SIZE // N_TOPICS
+    soups = []
+    for start in range(0, len(topics), chunk_size):
+        chunk_topics = topics[start : start + chunk_size]
+        ranks = rng.zipf(1.3, size=(len(chunk_topics), length_range[1])) % VOCABULARY_SIZE
+        tokens = words[(ranks + chunk_topics[:, None] * stride) % VOCABULARY_SIZE]
+        lengths = rng.integers(*length_range, size=len(chunk_topics))
+        soups.extend(" ".join(row[:length]) for row, length in zip(tokens, lengths))
+    return soups
+
+
+def _id_lists(rng, size, n_values, max_items, empty=None):
+    """Comma separated ids as written by the data pipeline, ``empty`` for movies without any."""
+    counts = rng.integers(0, max_items + 1, size=size)
+    values = rng.integers(1, n_values + 1, size=(size, max_items))
+    return [
+        ", ".join(str(value) for value in dict.fromkeys(row[:count].tolist())) if count else empty
+        for row, count in zip(values, counts)
+    ]
+
+
+def generate_catalogue(directory, size, seed=0):
+    """Write a synthetic catalogue of ``size`` movies to ``directory``.
+
+    Produces the ``app_data``, ``genres``, ``providers`` and ``soup_data`` parquet files read by
+    ``import_movie_data`` and ``build_recommender_model``, with similar columns and sparsity.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    ids = rng.permutation(4 * size)[:size] + 1
+    topics = rng.integers(0, N_TOPICS, size=size)
+    pd.DataFrame(
+        {
+            "id": ids,
+            "soup_plot": _soups(rng, topics, (30, 120)),
+            "soup_general": _soups(rng, topics, (8, 30)),
+        }
+    ).to_parquet(os.path.join(directory, "soup_data.parquet"))
+
+    free = rng.random(size) < 0.05
+    pd.DataFrame(
+        {
+            "id": ids,
+            "genre_ids": _id_lists(rng, size, N_GENRES, 3),
+            "title": [f"Movie {id}" for id in ids],
+            "overview": "overview",
+            "poster_path": "/poster.jpg",
+            "year": rng.integers(1950, 2025, size=size).astype(str),
+            "runtime": rng.integers(70, 180, size=size).astype(float),
+            "actors": "Actor A, Actor B",
+            "link": "https://www.themoviedb.org/movie",
+            "buy": _id_lists(rng, size, N_PROVIDERS, 4),
+            "flatrate": _id_lists(rng, size, N_PROVIDERS, 3),
+            "free": pd.Series(free, dtype=object),
+            "rent": _id_lists(rng, size, N_PROVIDERS, 4),
+        }
+    ).to_parquet(os.path.join(directory, "app_data.parquet"))
+
+    pd.DataFrame(
+        {"id": np.arange(1, N_GENRES + 1), "name": [f"Genre {id}" for id in range(1, N_GENRES + 1)]}
+    ).to_parquet(os.path.join(directory, "genres.parquet"))
+    pd.DataFrame(
+        {
+            "logo_path": "/logo.png",
+            "provider_name": [f"Provider {id}" for id in range(1, N_PROVIDERS + 1)],
+            "provider_id": np.arange(1, N_PROVIDERS + 1),
+        }
+    ).to_parquet(os.path.join(directory, "providers.parquet"))
+    return ids
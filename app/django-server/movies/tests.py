@@ -1,3 +1,718 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from movies.backends import ExactBackend, IVFBackend, IVFIndex
+from movies.catalogue import bump_catalogue_version
+from movies.filter_index import FilterIndex, get_filter_index, reset_filter_index
+from movies.management.commands import import_movie_data, load_test
+from movies.management.commands.import_movie_data import RELATION_COLUMNS
+from movies.models import Movie
+from movies.recommender import (
+    SPACES,
+    RecommenderModel,
+    get_model,
+    recommend,
+    recommend_batch,
+    score,
+    set_model,
+    update_model,
+)
+from movies.response_cache import get_response_cache
+from movies.score_cache import ScoreCache
+from movies.synthetic import FILTERS, generate_catalogue
+from movies.views import GetMoviesIdsView
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+def cosine_similarity(soups):
+    """Dense cosine similarity of the soups' term counts, computed without the model's code."""
+    counts = CountVectorizer(stop_words="english").fit_transform(soups).toarray().astype(np.float64)
+    norms = np.linalg.norm(counts, axis=1)
+    norms[norms == 0] = 1
+    unit = counts / norms[:, None]
+    return unit @ unit.T
+
+
+def temporary_directory(add_cleanup):
+    directory = tempfile.mkdtemp()
+    add_cleanup(shutil.rmtree, directory)
+    return directory
+
+
+class RecommenderTestCase(SimpleTestCase):
+    size = 300
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = temporary_directory(cls.addClassCleanup)
+        generate_catalogue(directory, cls.size, seed=1)
+        cls.soup_data = pd.read_parquet(os.path.join(directory, "soup_data.parquet"))
+        cls.similarity = {space: cosine_similarity(cls.soup_data[f"soup_{space}"]) for space in SPACES}
+        cls.model = RecommenderModel.build(cls.soup_data)
+        cls.rng = np.random.default_rng(0)
+
+    def reference_scores(self, rows, weight_plot=0.7):
+        plot, general = (self.similarity[space][rows].mean(axis=0) for space in ("plot", "general"))
+        return weight_plot * plot + (1 - weight_plot) * general
+
+    def assertRanked(self, rows, seeds, n_movies, weight_plot=0.7, mask=None):
+        """``rows`` hold the best ``n_movies`` reference scores outside the seeds and ``mask``."""
+        reference = self.reference_scores(seeds, weight_plot)
+        allowed = np.ones(len(reference), dtype=bool) if mask is None else mask.copy()
+        allowed[seeds] = False
+        self.assertEqual(len(rows), n_movies)
+        self.assertTrue(allowed[rows].all())
+        expected = np.sort(reference[allowed])[::-1][:n_movies]
+        np.testing.assert_allclose(reference[rows], expected, atol=1e-5)
+
+
+class ScoringTests(RecommenderTestCase):
+    def test_score_matches_brute_force_cosine(self):
+        for n_seeds in (1, 3, 5):
+            rows = self.rng.choice(self.size, n_seeds, replace=False)
+            np.testing.assert_allclose(score(self.model, rows), self.reference_scores(rows), atol=1e-5)
+            candidates = np.sort(self.rng.choice(self.size, 50, replace=False))
+            np.testing.assert_allclose(
+                score(self.model, rows, 0.4, candidates),
+                self.reference_scores(rows, 0.4)[candidates],
+                atol=1e-5,
+            )
+
+    def test_recommend_ranks_like_brute_force(self):
+        for n_seeds in (1, 2, 5):
+            rows = self.rng.choice(self.size, n_seeds, replace=False)
+            self.assertRanked(recommend(self.model, rows, n_movies=10), rows, 10)
+
+    def test_recommend_keeps_to_mask(self):
+        rows = self.rng.choice(self.size, 2, replace=False)
+        mask = self.rng.random(self.size) < 0.3
+        self.assertRanked(recommend(self.model, rows, n_movies=10, mask=mask), rows, 10, mask=mask)
+
+    def test_recommend_batch_ranks_like_brute_force(self):
+        rows_list = [self.rng.choice(self.size, n_seeds, replace=False) for n_seeds in (1, 2, 3, 4) * 5]
+        mask = self.rng.random(self.size) < 0.5
+        # Small blocks, so the queries are split over several of them
+        for n_jobs, block_mask in ((1, None), (2, mask)):
+            results = list(
+                recommend_batch(
+                    self.model, rows_list, n_movies=10, mask=block_mask, n_jobs=n_jobs, chunk_cells=10000
+                )
+            )
+            self.assertEqual(len(results), len(rows_list))
+            for rows, result in zip(rows_list, results):
+                self.assertRanked(result, rows, 10, mask=block_mask)
+
+
+@override_settings(RECOMMENDER_NEIGHBOUR_MAX_SEEDS=3)
+class NeighbourTests(RecommenderTestCase):
+    def neighbour_model(self, k):
+        model = RecommenderModel(self.model.ids, self.model.matrices, self.model.vocabularies)
+        model.build_neighbours(k, n_jobs=1)
+        return model
+
+    def test_neighbour_tables_match_brute_force_cosine(self):
+        k = 15
+        model = self.neighbour_model(k)
+        for space in SPACES:
+            indices, scores = model.neighbours[space]
+            similarity = self.similarity[space].copy()
+            np.fill_diagonal(similarity, -np.inf)
+            expected = -np.sort(-similarity, axis=1)[:, :k]
+            np.testing.assert_allclose(scores, expected, atol=1e-5)
+            np.testing.assert_allclose(
+                np.take_along_axis(similarity, indices.astype(np.int64), axis=1), scores, atol=1e-5
+            )
+
+    def test_complete_neighbour_lists_rank_like_brute_force(self):
+        model = self.neighbour_model(self.size - 1)
+        for n_seeds in (1, 2, 3):
+            rows = self.rng.choice(self.size, n_seeds, replace=False)
+            self.assertRanked(recommend(model, rows, n_movies=10), rows, 10)
+
+    def test_short_neighbour_lists_only_return_scored_neighbours(self):
+        model = self.neighbour_model(15)
+        rows = self.rng.choice(self.size, 1, replace=False)
+        recommended = recommend(model, rows, n_movies=10)
+        neighbours = np.union1d(*(model.neighbours[space][0][rows].ravel() for space in SPACES))
+        self.assertTrue(np.isin(recommended, neighbours).all())
+        reference = self.reference_scores(rows)
+        self.assertTrue((np.diff(reference[recommended]) <= 1e-6).all())
+
+    def test_mismatched_neighbour_tables_are_ignored_on_load(self):
+        directory = temporary_directory(self.addCleanup)
+        model = self.neighbour_model(5)
+        model.save(directory)
+        self.assertIsNotNone(RecommenderModel.load(directory).neighbours)
+
+        # Tables left over from another catalogue
+        np.save(os.path.join(model.directory, "plot_neighbours.npy"), model.neighbours["plot"][0][:-1])
+        with self.assertLogs("movies.recommender", "WARNING"):
+            self.assertIsNone(RecommenderModel.load(directory).neighbours)
+
+    def test_saving_without_neighbours_drops_the_previous_tables(self):
+        directory = temporary_directory(self.addCleanup)
+        self.neighbour_model(5).save(directory)
+        self.model.save(directory)
+        self.assertIsNone(RecommenderModel.load(directory).neighbours)
+
+
+class IVFBackendTests(RecommenderTestCase):
+    def test_lists_partition_the_catalogue(self):
+        index = IVFIndex.build(self.model, n_lists=8, n_components=16)
+        self.assertEqual(sorted(index.order.tolist()), list(range(self.size)))
+        self.assertEqual(index.offsets[0], 0)
+        self.assertEqual(index.offsets[-1], self.size)
+        self.assertTrue((np.diff(index.offsets) >= 0).all())
+
+    def test_probing_every_list_ranks_like_brute_force(self):
+        index = IVFIndex.build(self.model, n_lists=8, n_components=16)
+        backend = IVFBackend(self.model, index, n_probe=index.n_lists)
+        rows = self.rng.choice(self.size, 2, replace=False)
+        self.assertEqual(len(backend.candidates(rows, 0.7)), self.size)
+        self.assertRanked(recommend(self.model, rows, n_movies=10, backend=backend), rows, 10)
+
+    def test_probed_recommendations_are_scored_exactly(self):
+        index = IVFIndex.build(self.model, n_lists=8, n_components=16)
+        backend = IVFBackend(self.model, index, n_probe=2)
+        rows = self.rng.choice(self.size, 4, replace=False)
+        recommended = recommend(self.model, rows, n_movies=10, backend=backend)
+        self.assertEqual(len(recommended), 10)
+        self.assertFalse(np.isin(recommended, rows).any())
+        self.assertTrue((np.diff(self.reference_scores(rows)[recommended]) <= 1e-6).all())
+
+    def test_missing_or_mismatched_index_falls_back_to_exact(self):
+        directory = temporary_directory(self.addCleanup)
+        self.model.save(directory)
+        model = RecommenderModel.load(directory)
+        with self.assertLogs("movies.backends", "WARNING"):
+            self.assertIs(type(IVFBackend.from_model(model)), ExactBackend)
+
+        small = RecommenderModel.build(self.soup_data.iloc[:100])
+        IVFIndex.build(small, n_lists=4, n_components=8).save(os.path.join(model.directory, "ivf"))
+        with self.assertLogs("movies.backends", "WARNING"):
+            self.assertIs(type(IVFBackend.from_model(model)), ExactBackend)
+
+        IVFIndex.build(model, n_lists=4, n_components=8).save(os.path.join(model.directory, "ivf"))
+        self.assertIs(type(IVFBackend.from_model(model)), IVFBackend)
+
+    def test_update_keeps_every_row_listed(self):
+        initial = self.soup_data.iloc[:250]
+        model = RecommenderModel.build(initial)
+        index = IVFIndex.build(model, n_lists=8, n_components=16)
+        upserts = initial.iloc[:20].assign(id=self.soup_data["id"].iloc[250:270].to_numpy())
+        updated, old_rows = update_model(model, upserts, initial["id"].iloc[:5].to_numpy(), n_jobs=1)
+        updated_index = index.update(updated, old_rows)
+        self.assertEqual(sorted(updated_index.order.tolist()), list(range(len(updated))))
+        self.assertEqual(len(updated_index.vectors), len(updated))
+
+
+class UpdateModelTests(RecommenderTestCase):
+    k = 10
+
+    def setUp(self):
+        self.initial = self.soup_data.iloc[:250]
+        self.model = RecommenderModel.build(self.initial)
+        self.model.build_neighbours(self.k, n_jobs=1)
+
+    def assertUpdateMatchesRebuild(self, upserts, deleted_ids):
+        model = self.model
+        updated, old_rows = update_model(model, upserts, deleted_ids, n_jobs=1)
+        final = pd.concat([self.initial[~self.initial["id"].isin([*upserts["id"], *deleted_ids])], upserts])
+        rebuilt = RecommenderModel.build(final)
+        rebuilt.build_neighbours(self.k, n_jobs=1)
+
+        self.assertCountEqual(updated.ids.tolist(), rebuilt.ids.tolist())
+        np.testing.assert_array_equal(updated.ids[: len(old_rows)], model.ids[old_rows])
+        order = rebuilt.rows(updated.ids)
+        for space in SPACES:
+            updated_similarity = (updated.matrices[space] @ updated.matrices[space].T).toarray()
+            rebuilt_matrix = rebuilt.matrices[space][order]
+            np.testing.assert_allclose(
+                updated_similarity, (rebuilt_matrix @ rebuilt_matrix.T).toarray(), atol=1e-5
+            )
+
+            indices, scores = updated.neighbours[space]
+            np.testing.assert_allclose(scores, np.asarray(rebuilt.neighbours[space][1])[order], atol=1e-5)
+            np.testing.assert_allclose(
+                np.take_along_axis(updated_similarity, indices.astype(np.int64), axis=1), scores, atol=1e-5
+            )
+
+    def test_update_matches_full_rebuild(self):
+        # Soups of known movies, so the frozen vocabularies cover every term
+        donors = self.initial.sample(40, random_state=0)
+        changed_ids = self.initial["id"].iloc[:10].to_numpy()
+        new_ids = self.soup_data["id"].iloc[250:280].to_numpy()
+        upserts = donors.assign(id=np.concatenate([changed_ids, new_ids]))
+        self.assertUpdateMatchesRebuild(upserts, self.initial["id"].iloc[100:115].to_numpy())
+
+    def test_deletes_alone_match_full_rebuild(self):
+        self.assertUpdateMatchesRebuild(self.initial.iloc[:0], self.initial["id"].iloc[::10].to_numpy())
+
+
+class SavedModelTests(RecommenderTestCase):
+    def setUp(self):
+        self.directory = temporary_directory(self.addCleanup)
+
+    def assertScoresLikeBuilt(self, model):
+        self.assertEqual(model.ids.tolist(), self.model.ids.tolist())
+        rows = model.rows(self.model.ids[[4, 40, 100]])
+        np.testing.assert_allclose(score(model, rows), score(self.model, [4, 40, 100]), atol=1e-6)
+
+    def test_saved_models_load_memory_mapped(self):
+        self.model.save(self.directory)
+        model = RecommenderModel.load(self.directory)
+        self.assertScoresLikeBuilt(model)
+        self.assertEqual(model.vocabularies, self.model.vocabularies)
+        for space in SPACES:
+            matrix = model.matrices[space]
+            for array in (matrix.data, matrix.indices, matrix.indptr):
+                self.assertMapped(array)
+        self.assertMapped(model.ids)
+
+    def assertMapped(self, array):
+        """``array`` is read-only and backed by a memory-mapped file, possibly through views."""
+        self.assertFalse(array.flags.writeable)
+        while array is not None and not isinstance(array, np.memmap):
+            array = array.base
+        self.assertIsInstance(array, np.memmap)
+
+    def test_publishing_keeps_the_current_and_previous_generations(self):
+        generations = []
+        for _ in range(3):
+            self.model.save(self.directory)
+            generations.append(os.path.basename(self.model.directory))
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory) if name.startswith("model-")), generations[1:]
+        )
+        with open(os.path.join(self.directory, "CURRENT")) as file:
+            self.assertEqual(file.read(), generations[2])
+        self.assertEqual(RecommenderModel.load(self.directory).directory, self.model.directory)
+
+    def test_models_saved_in_the_npz_layout_still_load(self):
+        for space in SPACES:
+            sparse.save_npz(os.path.join(self.directory, f"{space}_matrix.npz"), self.model.matrices[space])
+        np.save(os.path.join(self.directory, "ids.npy"), self.model.ids)
+        with open(os.path.join(self.directory, "vocabulary.json"), "w") as file:
+            json.dump(self.model.vocabularies, file)
+        self.assertTrue(RecommenderModel.exists(self.directory))
+        self.assertScoresLikeBuilt(RecommenderModel.load(self.directory))
+
+
+class ScoreCacheTests(RecommenderTestCase):
+    def setUp(self):
+        self.cache = ScoreCache(self.model, 2**20)
+
+    def test_cached_scores_match_brute_force_cosine(self):
+        for rows in ([3], [3, 8, 21], [8, 21]):
+            np.testing.assert_allclose(self.cache.score(rows), self.reference_scores(rows), atol=1e-5)
+        self.assertEqual(self.cache.stats()["hits"], 3)
+        self.assertEqual(self.cache.stats()["misses"], 3)
+
+    def test_candidate_lookups_are_counted_and_fill_the_cache(self):
+        candidates = np.sort(self.rng.choice(self.size, 50, replace=False))
+        for _ in range(2):
+            np.testing.assert_allclose(
+                self.cache.score([5, 9], 0.4, candidates),
+                self.reference_scores([5, 9], 0.4)[candidates],
+                atol=1e-5,
+            )
+        self.assertEqual(self.cache.stats()["misses"], 2)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+        self.assertEqual(self.cache.stats()["entries"], 2)
+
+    def test_vectors_beyond_the_budget_are_evicted(self):
+        cache = ScoreCache(self.model, 2 * self.size * 4)
+        cache.score([1, 2, 3])
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+
+
+class CatalogueTestCase(TestCase):
+    """Synthetic catalogue imported into the test database, with a model built from its soups."""
+
+    size = 400
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = temporary_directory(cls.addClassCleanup)
+        overridden = override_settings(
+            STATIC_DIR=cls.directory,
+            RECOMMENDER_SOUP_DATA=os.path.join(cls.directory, "soup_data.parquet"),
+            RECOMMENDER_MODEL_DIR=os.path.join(cls.directory, "model"),
+            CATALOGUE_VERSION_FILE=os.path.join(cls.directory, "catalogue_version"),
+            CATALOGUE_CHANGESET_DIR=os.path.join(cls.directory, "changesets"),
+        )
+        overridden.enable()
+        cls.addClassCleanup(overridden.disable)
+        cls.addClassCleanup(set_model, None)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_catalogue(cls.directory, cls.size, seed=2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("import_movie_data", bulk=True)
+            call_command("build_recommender_model", neighbours=20, jobs=1)
+        soup_data = pd.read_parquet(os.path.join(cls.directory, "soup_data.parquet"))
+        cls.positions = {int(id): position for position, id in enumerate(soup_data["id"])}
+        cls.similarity = {space: cosine_similarity(soup_data[f"soup_{space}"]) for space in SPACES}
+
+    def setUp(self):
+        set_model(None)
+        reset_filter_index()
+        get_response_cache().clear()
+
+    def orm_ids(self, filters):
+        return sorted(Movie.objects.filter(**filters).distinct().values_list("id", flat=True))
+
+    def post(self, path, data):
+        return self.client.post(path, data, content_type="application/json")
+
+    def reference_scores(self, seed_ids, weight_plot=0.7):
+        """Brute-force scores of every movie id for the seed ids."""
+        rows = [self.positions[id] for id in seed_ids]
+        plot, general = (self.similarity[space][rows].mean(axis=0) for space in ("plot", "general"))
+        scores = weight_plot * plot + (1 - weight_plot) * general
+        return {id: scores[position] for id, position in self.positions.items()}
+
+    def assertRecommended(self, ids, seed_ids, candidate_ids, n_movies=10, ignore_ids=()):
+        """``ids`` hold the best reference scores among the candidates that are not seeds or ignored."""
+        scores = self.reference_scores(seed_ids)
+        allowed = set(candidate_ids) - set(seed_ids) - set(ignore_ids)
+        self.assertEqual(len(ids), min(n_movies, len(allowed)))
+        self.assertLessEqual(set(ids), allowed)
+        expected = sorted((scores[id] for id in allowed), reverse=True)[:n_movies]
+        np.testing.assert_allclose([scores[id] for id in ids], expected, atol=1e-5)
+
+
+class FilterMovieViewTests(CatalogueTestCase):
+    def test_filters_without_seeds_list_the_matching_movies(self):
+        for filters in FILTERS:
+            with self.subTest(filters=filters):
+                self.assertEqual(sorted(self.post("/filter-movie/", filters).json()), self.orm_ids(filters))
+
+    def test_seeds_are_ranked_among_the_filtered_movies(self):
+        seed_ids = self.orm_ids({})[:3]
+        for filters in FILTERS[1:]:
+            for n_seeds in (1, 3):
+                with self.subTest(filters=filters, n_seeds=n_seeds):
+                    response = self.post("/filter-movie/", {"ids": seed_ids[:n_seeds], **filters})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertRecommended(response.json(), seed_ids[:n_seeds], self.orm_ids(filters))
+
+    def test_unfiltered_seeds_rank_every_movie(self):
+        ids = self.orm_ids({})
+        seed_ids, ignore_ids = ids[10:14], ids[:50]
+        response = self.post(
+            "/filter-movie/", {"ids": seed_ids, "ignore_ids": ignore_ids, "n_movies": 20, "weight_plot": 0.7}
+        )
+        self.assertRecommended(response.json(), seed_ids, ids, n_movies=20, ignore_ids=ignore_ids)
+
+    def test_invalid_parameters_are_rejected(self):
+        response = self.post("/filter-movie/", {"ids": [self.orm_ids({})[0]], "n_movies": "many"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batches_rank_every_query_among_the_filtered_movies(self):
+        filters = {"genres__in": [1, 2, 3]}
+        candidate_ids = self.orm_ids(filters)
+        queries = [{"ids": candidate_ids[:2]}, {"ids": candidate_ids[5:6], "ignore_ids": candidate_ids[:3]}]
+        response = self.post("/recommendations/batch/", {"queries": queries, "n_movies": 5, **filters})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([line["index"] for line in lines], [0, 1])
+        for query, line in zip(queries, lines):
+            self.assertRecommended(line["ids"], query["ids"], candidate_ids, 5, query.get("ignore_ids", ()))
+
+    def test_invalid_batches_are_rejected(self):
+        response = self.post("/recommendations/batch/", {"queries": [{"ignore_ids": [1]}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filters_rejected_by_the_orm_answer_no_movies(self):
+        with self.assertLogs("movies.views", "ERROR"):
+            response = self.post("/filter-movie/", {"no_such_field": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+
+class AsyncFilterMovieViewTests(CatalogueTestCase):
+    def test_answers_match_the_sync_view(self):
+        ids = self.orm_ids({})
+        for data in ({"genres__in": [1, 2]}, {"ids": ids[:2], "genres__in": [1, 2]}, {"ids": ids[3:6]}):
+            with self.subTest(data=data):
+                expected = self.post("/filter-movie/", data).json()
+                get_response_cache().clear()
+                self.assertEqual(self.post("/async/filter-movie/", data).json(), expected)
+
+    @override_settings(RECOMMENDER_ASYNC_MAX_PENDING=0)
+    def test_scoring_beyond_the_pending_limit_is_refused(self):
+        response = self.post("/async/filter-movie/", {"ids": self.orm_ids({})[:2]})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        # Refusals are not cached, and requests without seeds never wait for scoring
+        self.assertEqual(get_response_cache().stats()["size"], 0)
+        self.assertEqual(self.post("/async/filter-movie/", {"genres__in": [1]}).status_code, 200)
+
+    def test_invalid_bodies_are_rejected(self):
+        self.assertEqual(self.post("/async/filter-movie/", [1, 2]).status_code, 400)
+        self.assertEqual(self.post("/async/filter-movie/", {"ids": ["x"]}).status_code, 400)
+
+
+class ResponseCacheTests(CatalogueTestCase):
+    def test_repeated_requests_are_answered_from_the_cache(self):
+        data = {"ids": self.orm_ids({})[:2], "genres__in": [1, 2]}
+        first = self.post("/filter-movie/", data).json()
+        # Equivalent bodies share their entry whatever the order of their lists
+        second = self.post("/filter-movie/", {**data, "ids": data["ids"][::-1]}).json()
+        self.assertEqual(second, first)
+        self.assertEqual(get_response_cache().stats()["hits"], 1)
+
+    def test_catalogue_version_bumps_invalidate_the_cache(self):
+        data = {"genres__in": [1, 2]}
+        self.post("/filter-movie/", data)
+        bump_catalogue_version()
+        self.post("/filter-movie/", data)
+        self.assertEqual(get_response_cache().stats()["hits"], 0)
+        self.post("/filter-movie/", data)
+        self.assertEqual(get_response_cache().stats()["hits"], 1)
+
+    def test_filters_rejected_by_the_orm_are_not_cached(self):
+        for path in ("/filter-movie/", "/async/filter-movie/"):
+            with self.subTest(path=path), self.assertLogs("movies.views", "ERROR"):
+                self.post(path, {"no_such_field": 1})
+                self.post(path, {"no_such_field": 1})
+        self.assertEqual(get_response_cache().stats()["hits"], 0)
+        self.assertEqual(get_response_cache().stats()["size"], 0)
+
+
+class NoModelTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        overridden = override_settings(RECOMMENDER_MODEL_DIR=temporary_directory(self.addCleanup))
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def test_cache_stats_leave_out_the_score_cache(self):
+        response = self.client.get("/cache-stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("score_cache", response.json())
+
+    def test_seeded_requests_recommend_nothing(self):
+        ids = self.orm_ids({})[:2]
+        for path in ("/filter-movie/", "/async/filter-movie/"):
+            with self.subTest(path=path):
+                response = self.post(path, {"ids": ids, "genres__in": [1]})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), [])
+        response = self.post("/recommendations/batch/", {"queries": [{"ids": ids}, {"ids": ids[:1]}]})
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(lines, [{"index": 0, "ids": []}, {"index": 1, "ids": []}])
+
+    def test_loading_reports_the_missing_model(self):
+        with self.assertRaisesMessage(FileNotFoundError, "build_recommender_model"):
+            RecommenderModel.load(self.directory + "/missing")
+
+
+class FilterIndexTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = FilterIndex.build()
+
+    def test_indexed_filters_match_the_orm(self):
+        ids = sorted(Movie.objects.values_list("id", flat=True))
+        filters = [
+            *(filters for filters in FILTERS if not any(key.startswith("title") for key in filters)),
+            {"genres__id__in": [3, 4]},
+            {"genres__pk": 7},
+            {"buy": 7, "free": False},
+            {"rent__provider_id__in": [1, 2], "year__lte": "1960"},
+            {"year": "1999"},
+            {"year__in": ["1999", "2000"], "streaming__in": [4]},
+            {"year__gt": "2010", "genres__in": [1, 5, 9]},
+            {"pk__in": ids[:20] + [0]},
+            {"id": ids[5]},
+            {"genres__in": []},
+        ]
+        for filters in filters:
+            with self.subTest(filters=filters):
+                self.assertEqual(self.index.filter(filters).tolist(), self.orm_ids(filters))
+
+    def test_unsupported_filters_are_left_to_the_orm(self):
+        for filters in (
+            {"title__startswith": "Movie 1"},
+            {"genres__name": "Genre 1"},
+            {"year__range": ["1990", "2000"]},
+            # One related row must match both, which posting lists cannot tell
+            {"genres": 4, "genres__in": [5]},
+            {"streaming__in": [1, 2], "streaming": 3},
+        ):
+            with self.subTest(filters=filters):
+                self.assertIsNone(self.index.filter(filters))
+
+    def test_index_follows_catalogue_versions(self):
+        movie = Movie.objects.order_by("id").first()
+        self.assertIn(movie.id, get_filter_index().filter({"year": movie.year}).tolist())
+        Movie.objects.filter(id=movie.id).update(year="1800")
+        with override_settings(FILTER_INDEX_TTL=None):
+            self.assertIn(movie.id, get_filter_index().filter({"year": movie.year}).tolist())
+            bump_catalogue_version()
+            self.assertEqual(get_filter_index().filter({"year": "1800"}).tolist(), [movie.id])
+
+    def test_view_filters_like_the_orm(self):
+        view = GetMoviesIdsView()
+        with override_settings(FILTER_INDEX_TTL=None):
+            for filters in ({"genres": 4, "genres__in": [4, 5]}, {"genres__in": [2], "free": True}):
+                with self.subTest(filters=filters):
+                    self.assertEqual(sorted(view.filtered_ids(filters)), self.orm_ids(filters))
+
+
+class ImportTestCase(CatalogueTestCase):
+    def app_data(self):
+        return pd.read_parquet(os.path.join(self.directory, "app_data.parquet"))
+
+    def import_catalogue(self, app_data, **options):
+        """Import ``app_data`` with the catalogue's genres and providers, returning what was printed."""
+        directory = temporary_directory(self.addCleanup)
+        for name in ("genres", "providers"):
+            shutil.copy(os.path.join(self.directory, f"{name}.parquet"), directory)
+        app_data.to_parquet(os.path.join(directory, "app_data.parquet"))
+        output = io.StringIO()
+        with override_settings(STATIC_DIR=directory), contextlib.redirect_stdout(output):
+            call_command("import_movie_data", **options)
+        return output.getvalue()
+
+    def assertCatalogue(self, app_data):
+        """The database holds exactly the movies of ``app_data``, with their titles and links."""
+        movies = Movie.objects.prefetch_related(*RELATION_COLUMNS).in_bulk()
+        self.assertEqual(sorted(movies), sorted(app_data["id"].tolist()))
+        for row in app_data.itertuples():
+            movie = movies[row.id]
+            self.assertEqual(movie.title, row.title)
+            for relation, column in RELATION_COLUMNS.items():
+                value = getattr(row, column)
+                expected = {int(id) for id in value.split(",")} if isinstance(value, str) else set()
+                self.assertEqual({related.pk for related in getattr(movie, relation).all()}, expected)
+
+
+class BulkImportTests(ImportTestCase):
+    def test_bulk_import_links_every_relation(self):
+        self.assertCatalogue(self.app_data())
+
+    def test_bulk_reimport_replaces_fields_and_links(self):
+        app_data = self.app_data()
+        app_data.loc[:9, "genre_ids"] = "1"
+        app_data.loc[10:19, "buy"] = None
+        app_data.loc[20:29, "rent"] = "2, 3"
+        app_data.loc[30:39, "title"] = "Renamed"
+        self.import_catalogue(app_data, bulk=True, batch_size=64)
+        self.assertCatalogue(app_data)
+
+
+class IncrementalImportTests(ImportTestCase):
+    def changeset_paths(self):
+        directory = os.path.join(self.directory, "changesets")
+        return set(os.listdir(directory)) if os.path.isdir(directory) else set()
+
+    def import_changes(self, app_data):
+        output = self.import_catalogue(app_data, incremental=True, batch_size=64)
+        with open(output.rsplit("Changeset written to ", 1)[1].strip()) as file:
+            return json.load(file)
+
+    def test_incremental_import_applies_and_records_the_changes(self):
+        app_data = self.app_data()
+        deleted = sorted(app_data["id"].iloc[:5].tolist())
+        changed = sorted(app_data["id"].iloc[5:10].tolist())
+        app_data.loc[5:6, "title"] = "Renamed"
+        app_data.loc[7:8, "genre_ids"] = "1, 2"
+        app_data.loc[9, "free"] = not app_data.loc[9, "free"]
+        added_rows = app_data.iloc[10:13].assign(id=app_data["id"].max() + np.arange(1, 4))
+        app_data = pd.concat([app_data.iloc[5:], added_rows], ignore_index=True)
+
+        changeset = self.import_changes(app_data)
+        self.assertEqual(changeset["added"], sorted(added_rows["id"].tolist()))
+        self.assertEqual(changeset["changed"], changed)
+        self.assertEqual(changeset["deleted"], deleted)
+        self.assertCatalogue(app_data)
+
+    def test_unchanged_catalogue_records_no_changes(self):
+        changeset = self.import_changes(self.app_data())
+        self.assertEqual((changeset["added"], changeset["changed"], changeset["deleted"]), ([], [], []))
+
+    def test_failed_import_rolls_back_and_records_nothing(self):
+        app_data = self.app_data()
+        before = self.changeset_paths()
+        with mock.patch.object(
+            import_movie_data.Command, "_bulk_create_movies", side_effect=RuntimeError("Disk full")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.import_catalogue(app_data.iloc[10:], incremental=True)
+        # The deletes ran before the failure and were rolled back with it
+        self.assertCatalogue(app_data)
+        self.assertEqual(self.changeset_paths(), before)
+
+    def test_legacy_import_stores_content_hashes(self):
+        app_data = self.app_data().iloc[:30]
+        app_data = app_data.assign(
+            **{column: app_data[column].fillna("1") for column in RELATION_COLUMNS.values()}
+        )
+        app_data = app_data.assign(title="Renamed")
+        self.import_catalogue(app_data)
+        changeset = self.import_changes(app_data)
+        self.assertEqual((changeset["added"], changeset["changed"]), ([], []))
+        self.assertCatalogue(app_data)
+
+
+class ModelPublishingTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        # Updates publish into the model directory, which the other tests share
+        model_directory = os.path.join(temporary_directory(self.addCleanup), "model")
+        shutil.copytree(os.path.join(self.directory, "model"), model_directory)
+        overridden = override_settings(RECOMMENDER_MODEL_DIR=model_directory)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def update(self, **changeset):
+        path = os.path.join(temporary_directory(self.addCleanup), "changeset.json")
+        with open(path, "w") as file:
+            json.dump({"added": [], "changed": [], "deleted": [], **changeset}, file)
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("update_recommender_model", path, jobs=1)
+
+    def test_updates_are_served_once_published(self):
+        model = get_model()
+        deleted = model.ids[:5].tolist()
+        self.update(deleted=deleted)
+
+        updated = get_model()
+        self.assertIsNot(updated, model)
+        self.assertEqual(len(updated), len(model) - 5)
+        self.assertFalse(np.isin(deleted, updated.ids).any())
+        # Requests still holding the previous model keep reading its generation
+        self.assertEqual(len(score(model, [0])), len(model))
+        response = self.post("/filter-movie/", {"ids": updated.ids[:2].tolist(), "n_movies": 50})
+        self.assertFalse(np.isin(deleted, response.json()).any())
+
+    def test_version_bumps_without_a_new_model_keep_the_loaded_one(self):
+        model = get_model()
+        bump_catalogue_version()
+        self.assertIs(get_model(), model)
+
+
+class LoadTestCommandTests(SimpleTestCase):
+    def test_unavailable_servers_fail_before_seeding(self):
+        with self.assertRaisesMessage(CommandError, "Unknown server"):
+            call_command("load_test", servers="wsgi,gunicorn")
+        with mock.patch.object(load_test.importlib.util, "find_spec", return_value=None):
+            with self.assertRaisesMessage(CommandError, "uvicorn is not installed"):
+                call_command("load_test", servers="wsgi,asgi")
@@ -1,6 +1,18 @@
 from django.urls import include, path
-from movies.views import GetMoviesIdsView
+from django.views.decorators.csrf import csrf_exempt
+from movies.views import (
+    AsyncGetMoviesIdsView,
+    BatchRecommendationsView,
+    CacheStatsView,
+    GetMoviesIdsView,
+    MetricsView,
+)
 
 urlpatterns = [
     path("filter-movie/", GetMoviesIdsView.as_view(), name="filter_movies"),
+    path("async/filter-movie/", csrf_exempt(AsyncGetMoviesIdsView.as_view()), name="async_filter_movies"),
+    path("recommendations/batch/", BatchRecommendationsView.as_view(), name="batch_recommendations"),
+    path("cache-stats/", CacheStatsView.as_view(), name="cache_stats"),
+    # Prometheus scrapes /metrics by default
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,86 +1,300 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from movies.backends import get_backend
+from movies.catalogue import catalogue_version
+from movies.filter_index import get_filter_index
+from movies.metrics import (
+    CANDIDATES,
+    FILTER_ERRORS,
+    FILTER_SECONDS,
+    SCORING_SECONDS,
+    SERIALISATION_SECONDS,
+    TimedJSONRenderer,
+)
 from movies.models import Movie
+from movies.profiling import phase
+from movies.recommender import get_model, recommend, recommend_batch
+from movies.response_cache import cache_key, get_response_cache
+from movies.score_cache import get_score_cache
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from rest_framework import status
 from rest_framework.permissions import AllowAny
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
 
 class GetMoviesIdsView(APIView):
-    renderer_classes = [JSONRenderer]
+    """Filter the catalogue and, when seed ``ids`` are sent, rank the filtered movies.
+
+    Every key of the body other than ``ids``, ``ignore_ids``, ``weight_plot`` and
+    ``n_movies`` is passed to ``Movie.objects.filter``. Successful responses are cached per
+    catalogue version.
+    """
+
+    renderer_classes = [TimedJSONRenderer]
     permission_classes = (AllowAny,)
+    recommendation_fields = ("ids", "ignore_ids", "weight_plot", "n_movies")
+    # Set when the ORM rejected the filters, so that the empty answer is not cached
+    filter_failed = False
 
     def filtered_ids(self, filters={}):
+        with phase("index"), FILTER_SECONDS.labels("index").time():
+            movies_ids = get_filter_index().filter(filters)
+        if movies_ids is not None:
+            CANDIDATES.observe(len(movies_ids))
+            return movies_ids.tolist()
         try:
-            movies_qs = Movie.objects.prefetch_related("genres", "streaming", "buy", "rent").filter(**filters)
-            movies_ids = movies_qs.values_list("id", flat=True)
+            with phase("db"), FILTER_SECONDS.labels("orm").time():
+                movies_qs = Movie.objects.filter(**filters).distinct()
+                movies_ids = list(movies_qs.values_list("id", flat=True))
+            CANDIDATES.observe(len(movies_ids))
             return movies_ids
-        except Exception as e:
-            print(str(e))
+        except Exception:
+            FILTER_ERRORS.inc()
+            logger.exception("Filters %r rejected by the ORM", filters)
+            self.filter_failed = True
             return []
 
+    def respond(self, data):
+        filters = {key: value for key, value in data.items() if key not in self.recommendation_fields}
+        if not data.get("ids"):
+            return Response(self.filtered_ids(filters))
+        # Without filters every movie is a candidate, so there is no id list to build
+        movies_ids = self.filtered_ids(filters) if filters else None
+
+        try:
+            with phase("score"):
+                recommended_ids = get_recommendations(
+                    [int(id) for id in data["ids"]],
+                    ignore_ids=[int(id) for id in data.get("ignore_ids", [])],
+                    weight_plot=float(data.get("weight_plot", 0.7)),
+                    n_movies=int(data.get("n_movies", 10)),
+                    candidate_ids=movies_ids,
+                )
+        except (TypeError, ValueError) as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(recommended_ids)
+
     def post(self, request, *args, **kwargs):
-        get_recommendations(self.filtered_ids(request.data))
-        return Response(self.filtered_ids(request.data))
+        response_cache = get_response_cache()
+        key = cache_key(request.data, catalogue_version())
+        cached = response_cache.get(key)
+        if cached is not None:
+            return Response(cached)
 
+        response = self.respond(request.data)
+        if response.status_code == status.HTTP_200_OK and not self.filter_failed:
+            response_cache.set(key, response.data)
+        return response
 
-def get_recommendations(ids):
-    pass
-from django.shortcuts import render
-from rest_framework.generics import RetrieveAPIView
-from rest_framework.permissions import AllowAny
-from rest_framework.renderers import JSONRenderer
-from rest_framework.response import Response
-from rest_framework import status, generics
-from rest_framework.views import APIView
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-from movies.models import Movie
 
+class BatchRecommendationsView(GetMoviesIdsView):
+    """Recommendations for many seed sets in one call, streamed back as NDJSON.
 
-# Create your views here.
+    The body holds ``queries``, a list of ``{"ids": [...], "ignore_ids": [...]}`` objects,
+    the shared ``weight_plot`` and ``n_movies``, and filters applied to every query. Each line
+    of the response is ``{"index": i, "ids": [...]}``, in query order.
+    """
 
+    recommendation_fields = ("queries", "weight_plot", "n_movies")
 
-class GetMoviesIdsView(APIView):
-    renderer_classes = [JSONRenderer]
-    permission_classes = (AllowAny,)
+    def post(self, request, *args, **kwargs):
+        try:
+            queries = [
+                ([int(id) for id in query["ids"]], [int(id) for id in query.get("ignore_ids", [])])
+                for query in request.data.get("queries", [])
+            ]
+            weight_plot = float(request.data.get("weight_plot", 0.7))
+            n_movies = int(request.data.get("n_movies", 10))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    def filtered_ids(self, filters={}):
+        filters = {key: value for key, value in request.data.items() if key not in self.recommendation_fields}
+        candidate_ids = self.filtered_ids(filters) if filters else None
+        results = get_batch_recommendations(queries, weight_plot, n_movies, candidate_ids)
+        lines = (json.dumps({"index": index, "ids": ids}) + "\n" for index, ids in enumerate(results))
+        return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+
+class AsyncGetMoviesIdsView(View):
+    """Async ``GetMoviesIdsView`` for ASGI servers.
+
+    Filtering uses the async ORM and scoring runs on the bounded scoring executor, so the
+    event loop never blocks on it. Requests that would queue more than
+    ``RECOMMENDER_ASYNC_MAX_PENDING`` scorings are refused with a 503.
+    """
+
+    recommendation_fields = GetMoviesIdsView.recommendation_fields
+    filter_failed = False
+    pending = 0
+
+    async def filtered_ids(self, filters={}):
+        index = await sync_to_async(get_filter_index)()
+        with phase("index"), FILTER_SECONDS.labels("index").time():
+            movies_ids = index.filter(filters)
+        if movies_ids is not None:
+            CANDIDATES.observe(len(movies_ids))
+            return movies_ids.tolist()
         try:
-            movies_qs = Movie.objects.prefetch_related('genres', 'streaming', 'buy', 'rent').filter(**filters)
-            movies_ids = movies_qs.values_list('id', flat=True)
+            with phase("db"), FILTER_SECONDS.labels("orm").time():
+                movies_qs = Movie.objects.filter(**filters).distinct()
+                movies_ids = [id async for id in movies_qs.values_list("id", flat=True)]
+            CANDIDATES.observe(len(movies_ids))
             return movies_ids
-        except Exception as e:
-            print(str(e))
+        except Exception:
+            FILTER_ERRORS.inc()
+            logger.exception("Filters %r rejected by the ORM", filters)
+            self.filter_failed = True
             return []
 
-    def post(self, request, *args, **kwargs):
-        get_recommendations(self.filtered_ids(request.data))
-        return Response(self.filtered_ids(request.data))
+    async def recommend(self, data, movies_ids):
+        """Recommended ids among ``movies_ids`` (any movie when None), or the error response to
+        send instead."""
+        if AsyncGetMoviesIdsView.pending >= settings.RECOMMENDER_ASYNC_MAX_PENDING:
+            response = JsonResponse(
+                {"detail": "Too many pending recommendations"}, status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response["Retry-After"] = "1"
+            return response
+
+        AsyncGetMoviesIdsView.pending += 1
+        try:
+            recommendations = functools.partial(
+                get_recommendations,
+                [int(id) for id in data["ids"]],
+                ignore_ids=[int(id) for id in data.get("ignore_ids", [])],
+                weight_plot=float(data.get("weight_plot", 0.7)),
+                n_movies=int(data.get("n_movies", 10)),
+                candidate_ids=movies_ids,
+            )
+            with phase("score"):
+                recommended_ids = await asyncio.get_running_loop().run_in_executor(
+                    get_scoring_executor(), recommendations
+                )
+        except (TypeError, ValueError) as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            AsyncGetMoviesIdsView.pending -= 1
+        return recommended_ids
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_cache = get_response_cache()
+        key = cache_key(data, catalogue_version())
+        cached = response_cache.get(key)
+        if cached is not None:
+            with phase("render"), SERIALISATION_SECONDS.time():
+                return JsonResponse(cached, safe=False)
+
+        filters = {key: value for key, value in data.items() if key not in self.recommendation_fields}
+        if not data.get("ids"):
+            result = await self.filtered_ids(filters)
+        else:
+            movies_ids = await self.filtered_ids(filters) if filters else None
+            result = await self.recommend(data, movies_ids)
+            if isinstance(result, JsonResponse):
+                return result
+
+        if not self.filter_failed:
+            response_cache.set(key, result)
+        with phase("render"), SERIALISATION_SECONDS.time():
+            return JsonResponse(result, safe=False)
+
+
+class CacheStatsView(APIView):
+    """Hit and miss counters of the filter-movie response cache and of the score cache."""
+
+    renderer_classes = [JSONRenderer]
+    permission_classes = (AllowAny,)
+
+    def get(self, request, *args, **kwargs):
+        stats = {**get_response_cache().stats(), "catalogue_version": catalogue_version()}
+        score_cache = get_score_cache()
+        if score_cache is not None:
+            stats["score_cache"] = score_cache.stats()
+        return Response(stats)
+
+
+class MetricsView(View):
+    """Prometheus metrics of this process, in the text exposition format."""
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
+_scoring_executor = None
+_scoring_executor_lock = threading.Lock()
+
+
+def get_scoring_executor():
+    """Thread pool of ``RECOMMENDER_ASYNC_WORKERS`` threads scoring for the async views."""
+    global _scoring_executor
+    if _scoring_executor is None:
+        with _scoring_executor_lock:
+            if _scoring_executor is None:
+                _scoring_executor = ThreadPoolExecutor(
+                    settings.RECOMMENDER_ASYNC_WORKERS, thread_name_prefix="scoring"
+                )
+    return _scoring_executor
+
+
+def get_recommendations(ids, ignore_ids=None, weight_plot=0.7, n_movies=10, candidate_ids=None):
+    """Movie ids most similar to the seed movie ids, best first.
 
+    When ``candidate_ids`` is given only those movies can be recommended. Nothing is
+    recommended while no model was built.
+    """
+    model = get_model()
+    if model is None:
+        return []
+    rows = model.rows(ids)
+    if not len(rows):
+        return []
 
-def get_recommendations(ids, ignore_ids=None, weight_plot=0.7, n_movies=10):
-    
-    if ignore_ids is None:
-        ignore_ids = ids
-    else:
-        ignore_ids.extend(ids)
+    exclude = model.rows(list(ids) + list(ignore_ids or []))
+    mask = None if candidate_ids is None else model.mask(candidate_ids)
+    with SCORING_SECONDS.time():
+        recommended_rows = recommend(
+            model, rows, exclude, weight_plot, n_movies, get_backend(), mask, get_score_cache()
+        )
+    recommended_ids = model.ids[recommended_rows].tolist()
 
-    data = pd.read_parquet('data/processed/soup_data.parquet')
-    count_vectorizer = CountVectorizer(stop_words="english")
+    return recommended_ids
 
-    plot_matrix = count_vectorizer.fit_transform(data["soup_plot"])
-    general_matrix = count_vectorizer.fit_transform(data["soup_general"])
-    plot_similarity = cosine_similarity(plot_matrix, plot_matrix)
-    general_similarity = cosine_similarity(general_matrix, general_matrix)
 
-    result_similarity = weight_plot * plot_similarity + (1 - weight_plot) * general_similarity
-    result = pd.DataFrame(result_similarity).iloc[ids]
-    mean_result = result.mean(axis=0)
-    sorted_result = mean_result.sort_values(ascending=False)
-    real_result = sorted_result.drop(ignore_ids)
-    recommended_ids = data.iloc[real_result.index[:n_movies]]['id'].tolist()
+def get_batch_recommendations(queries, weight_plot=0.7, n_movies=10, candidate_ids=None):
+    """Recommended movie ids for each ``(ids, ignore_ids)`` pair of ``queries``, in order.
 
-    return recommended_ids
\ No newline at end of file
+    Yields lists as the scoring blocks complete, see ``recommender.recommend_batch``.
+    """
+    model = get_model()
+    if model is None:
+        yield from ([] for _ in queries)
+        return
+    rows_list = [model.rows(ids) for ids, _ in queries]
+    exclude_list = [model.rows(list(ids) + list(ignore_ids)) for ids, ignore_ids in queries]
+    mask = None if candidate_ids is None else model.mask(candidate_ids)
+    for rows in recommend_batch(
+        model, rows_list, exclude_list, weight_plot, n_movies, mask, settings.RECOMMENDER_BATCH_JOBS
+    ):
+        yield model.ids[rows].tolist()
@@ -0,0 +1,166 @@
+import os
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import typer
+from tqdm import tqdm
+
+TRANSACTION_TYPES = ["buy", "flatrate", "free", "rent"]
+ID_LIST = pa.list_(pa.int32())
+
+# Same columns as the app_data.parquet of get_movie_data.ipynb, with native id lists instead of
+# comma joined strings
+SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("genre_ids", ID_LIST),
+        ("title", pa.string()),
+        ("overview", pa.string()),
+        ("poster_path", pa.string()),
+        ("year", pa.dictionary(pa.int32(), pa.string())),
+        ("runtime", pa.float64()),
+        ("actors", pa.string()),
+        ("link", pa.string()),
+        *[(transaction_type, ID_LIST) for transaction_type in TRANSACTION_TYPES],
+    ]
+)
+
+# Types of the CSV columns read, so they do not depend on what the first block looks like
+CSV_TYPES = {
+    "id": pa.int64(),
+    "genre_ids": pa.string(),
+    "title": pa.string(),
+    "overview": pa.string(),
+    "poster_path": pa.string(),
+    "release_date": pa.string(),
+    "imdb_id": pa.string(),
+    "runtime": pa.float64(),
+    "imdbID": pa.string(),
+    "Actors": pa.string(),
+    "link": pa.string(),
+    "transaction_type": pa.string(),
+    "provider_id": pa.int64(),
+}
+
+
+def open_dataset(path) -> ds.Dataset:
+    """What a ``RecordSink`` wrote to ``path``, in either format, as a lazily read dataset."""
+    parts = sorted(Path(f"{path}.parquet").glob("part-*.parquet"))
+    if parts:
+        # Parts written from different batches may disagree on the type of all-null columns
+        schema = pa.unify_schemas([pq.read_schema(part) for part in parts], promote_options="default")
+        return ds.dataset(parts, schema=schema, format="parquet")
+    # Empty fields are missing values, as for pandas.read_csv
+    convert_options = pacsv.ConvertOptions(column_types=CSV_TYPES, strings_can_be_null=True)
+    csv_format = ds.CsvFileFormat(convert_options=convert_options)
+    return ds.dataset(f"{path}.csv", format=csv_format)
+
+
+def parse_id_lists(array) -> pa.Array:
+    """``list<int32>`` ids from native lists, or from ``"[1, 2]"`` and ``"1, 2"`` strings."""
+    if not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+        return array.cast(ID_LIST)
+    text = pc.utf8_trim(array, characters="[] ")
+    empty = pc.fill_null(pc.equal(text, ""), True)
+    parts = pc.split_pattern(pc.if_else(empty, pa.scalar(None, pa.string()), text), ",")
+    values = pc.utf8_trim_whitespace(pc.list_flatten(parts)).cast(pa.int32())
+    lengths = pc.fill_null(pc.list_value_length(parts), 0).to_numpy(zero_copy_only=False)
+    offsets = pa.array([0, *lengths.cumsum()], pa.int32())
+    return pa.ListArray.from_arrays(offsets, values, mask=array.is_null())
+
+
+def lookup(keys, table: pa.Table, key: str) -> pa.Table:
+    """Rows of ``table`` whose ``key`` matches ``keys``, null when missing; the first row wins."""
+    return table.take(pc.index_in(keys, value_set=table[key].combine_chunks()))
+
+
+class AppDataBuilder:
+    def __init__(self, data_directory: str = "data", chunk_size: int = 50000):
+        self.data_directory = Path(data_directory)
+        self.chunk_size = chunk_size
+        self.raw_directory = Path(self.data_directory, "raw")
+        self.write_directory = Path(self.data_directory, "processed")
+
+    def load_side_tables(self):
+        """The per-movie tables joined to the top rated movies, as compact Arrow tables."""
+        additional_info = open_dataset(Path(self.raw_directory, "tmdb/additional_info")).to_table(
+            columns=["id", "imdb_id", "runtime"]
+        )
+        omdb_data = open_dataset(Path(self.raw_directory, "omdb/data")).to_table(columns=["imdbID", "Actors"])
+        movie_providers = open_dataset(Path(self.raw_directory, "tmdb/movie_providers")).to_table(
+            columns=["id", "link", "transaction_type", "provider_id"]
+        )
+
+        # One list of provider ids per movie and transaction type, in the order they were fetched
+        grouped = movie_providers.group_by(["id", "transaction_type"], use_threads=False).aggregate(
+            [("provider_id", "list")]
+        )
+        provider_lists = {
+            transaction_type: grouped.filter(pc.equal(grouped["transaction_type"], transaction_type))
+            for transaction_type in TRANSACTION_TYPES
+        }
+        return additional_info, omdb_data, movie_providers.select(["id", "link"]), provider_lists
+
+    def build_chunk(self, movies: pa.RecordBatch, additional_info, omdb_data, links, provider_lists):
+        ids = movies["id"]
+        info = lookup(ids, additional_info, "id")
+        columns = {
+            "id": ids,
+            "genre_ids": parse_id_lists(movies["genre_ids"]),
+            "title": movies["title"],
+            "overview": movies["overview"],
+            "poster_path": movies["poster_path"],
+            "year": pc.dictionary_encode(pc.utf8_slice_codeunits(movies["release_date"], 0, 4)),
+            "runtime": info["runtime"],
+            "actors": lookup(info["imdb_id"], omdb_data, "imdbID")["Actors"],
+            "link": lookup(ids, links, "id")["link"],
+        }
+        for transaction_type, lists in provider_lists.items():
+            columns[transaction_type] = lookup(ids, lists, "id")["provider_id_list"]
+        return pa.table(columns).cast(SCHEMA)
+
+    def copy_table(self, name: str):
+        table = open_dataset(Path(self.raw_directory, "tmdb", name)).to_table()
+        pq.write_table(table, Path(self.write_directory, f"{name}.parquet"))
+
+    def run(self):
+        start = time.perf_counter()
+        self.write_directory.mkdir(parents=True, exist_ok=True)
+        self.copy_table("genres")
+        self.copy_table("providers")
+
+        side_tables = self.load_side_tables()
+        top_rated_movies = open_dataset(Path(self.raw_directory, "tmdb/top_rated_movies"))
+        write_file = Path(self.write_directory, "app_data.parquet")
+        # Written under a temporary name, so an interrupted build keeps the previous file
+        temporary = write_file.with_suffix(".tmp")
+        rows = 0
+        with pq.ParquetWriter(temporary, SCHEMA) as writer:
+            batches = top_rated_movies.to_batches(
+                columns=["id", "genre_ids", "title", "overview", "poster_path", "release_date"],
+                batch_size=self.chunk_size,
+            )
+            for movies in tqdm(batches, desc="Building app data"):
+                writer.write_table(self.build_chunk(movies, *side_tables))
+                rows += movies.num_rows
+        os.replace(temporary, write_file)
+        elapsed = time.perf_counter() - start
+        print(f"{rows} movies written to {write_file} in {elapsed:.1f}s")
+
+
+def main(
+    data_directory: str = typer.Option(
+        help="Directory holding the raw/ and processed/ data.", default="data"
+    ),
+    chunk_size: int = typer.Option(help="Movies read and written per chunk.", default=50000),
+):
+    AppDataBuilder(data_directory, chunk_size).run()
+
+
+if __name__ == "__main__":
+    typer.run(main)
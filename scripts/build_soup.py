@@ -0,0 +1,219 @@
+import ast
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import nltk
+import pandas as pd
+import typer
+from nltk.stem import WordNetLemmatizer
+from nltk.tag.perceptron import PerceptronTagger
+from nltk.tokenize import RegexpTokenizer
+from sink import read_records
+from tqdm import tqdm
+
+TOKENIZER = RegexpTokenizer(r"\w+(?:'\w+)?")
+WORDNET_TAGS = {"J": "a", "R": "r", "N": "n", "V": "v"}
+TEXT_FEATURES = ["keywords", "overview", "tagline"]
+NAME_FEATURES = ["genres", "actors", "writers", "directors"]
+
+_stopwords = None
+_tagger = None
+# Loads WordNet lazily, on the first lemmatize call
+_lemmatizer = WordNetLemmatizer()
+
+
+def _setup_worker():
+    """Load the NLTK resources once per process instead of once per row."""
+    global _stopwords, _tagger
+    if _tagger is None:
+        _stopwords = frozenset(nltk.corpus.stopwords.words("english"))
+        _tagger = PerceptronTagger()
+
+
+@lru_cache(maxsize=2**20)
+def _lemma(word: str, tag: str) -> str:
+    use_tag = WORDNET_TAGS.get(tag[0])
+    return word if not use_tag else _lemmatizer.lemmatize(word, use_tag)
+
+
+def parse_keywords(x):
+    """Keywords as a list, from either the native lists of Parquet or the reprs of CSV."""
+    if isinstance(x, str):
+        return ast.literal_eval(x)
+    return list(x) if x is not None and not isinstance(x, float) else [""]
+
+
+def clean_data(x):
+    return [i.lower().replace(" ", "") for i in x] if x is not pd.NA else ""
+
+
+def lemmatize(x):
+    return [_lemma(word, tag) for word, tag in _tagger.tag(list(x))]
+
+
+def remove_stopwords(x):
+    return [word for words in x for word in words.split() if word.lower() not in _stopwords]
+
+
+def create_soup_general(x):
+    return (
+        f"{' '.join(x['keywords'])} {' '.join(x['directors'])} {' '.join(x['writers'])} "
+        f"{' '.join(x['actors'])} {' '.join(x['genres'])}"
+    )
+
+
+def create_soup_plot(x):
+    return f"{' '.join(x['overview'])} {' '.join(x['tagline'])}"
+
+
+def build_soups(nl_data: pd.DataFrame) -> pd.DataFrame:
+    """Tokenise, filter and lemmatise one chunk of the merged movie data into its soups."""
+    _setup_worker()
+    nl_data = nl_data.copy()
+
+    nl_data["keywords"] = nl_data["keywords"].apply(parse_keywords)
+    nl_data["overview"] = nl_data["overview"].map(str).apply(TOKENIZER.tokenize)
+    nl_data["tagline"] = nl_data["tagline"].map(str).apply(TOKENIZER.tokenize)
+
+    for feature in NAME_FEATURES:
+        nl_data[feature] = nl_data[feature].map(str).apply(lambda x: x.split(",") if x != "" else "")
+
+    for feature in TEXT_FEATURES:
+        nl_data[feature] = nl_data[feature].apply(remove_stopwords)
+
+    for feature in TEXT_FEATURES + NAME_FEATURES:
+        nl_data[feature] = nl_data[feature].apply(clean_data)
+
+    for feature in TEXT_FEATURES:
+        nl_data[feature] = nl_data[feature].apply(lemmatize)
+
+    nl_data["soup_plot"] = nl_data.apply(create_soup_plot, axis=1)
+    nl_data["soup_general"] = nl_data.apply(create_soup_general, axis=1)
+    return nl_data[["id", "soup_plot", "soup_general"]]
+
+
+def build_soups_notebook(nl_data: pd.DataFrame) -> pd.DataFrame:
+    """Serial path of notebooks/recommender.ipynb, kept as the baseline for ``--compare``."""
+    nl_data = nl_data.copy()
+    stopwords = nltk.corpus.stopwords.words("english")
+
+    def notebook_lemmatize(x):
+        wnl = WordNetLemmatizer()
+        lemmatized = []
+        for word, tag in nltk.pos_tag([word for word in x]):
+            use_tag = WORDNET_TAGS.get(tag[0])
+            lemmatized.append(word if not use_tag else wnl.lemmatize(word, use_tag))
+        return lemmatized
+
+    nl_data["keywords"] = nl_data["keywords"].apply(parse_keywords)
+    nl_data["overview"] = nl_data["overview"].map(str).apply(lambda x: TOKENIZER.tokenize(x))
+    nl_data["tagline"] = nl_data["tagline"].map(str).apply(lambda x: TOKENIZER.tokenize(x))
+    for feature in NAME_FEATURES:
+        nl_data[feature] = nl_data[feature].map(str).apply(lambda x: x.split(",") if x != "" else "")
+    for feature in TEXT_FEATURES:
+        nl_data[feature] = nl_data[feature].apply(
+            lambda x: [word for words in x for word in words.split() if word.lower() not in stopwords]
+        )
+    for feature in TEXT_FEATURES + NAME_FEATURES:
+        nl_data[feature] = nl_data[feature].apply(clean_data)
+    for feature in TEXT_FEATURES:
+        nl_data[feature] = nl_data[feature].apply(notebook_lemmatize)
+
+    nl_data["soup_plot"] = nl_data.apply(create_soup_plot, axis=1)
+    nl_data["soup_general"] = nl_data.apply(create_soup_general, axis=1)
+    return nl_data[["id", "soup_plot", "soup_general"]]
+
+
+class SoupBuilder:
+    def __init__(self, data_directory: str = "data", workers: int | None = None, chunk_size: int = 500):
+        self.data_directory = Path(data_directory)
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.write_file = Path(self.data_directory, "processed", "soup_data.parquet")
+
+    def load(self) -> pd.DataFrame:
+        top_rated_movies = pd.read_csv(Path(self.data_directory, "raw/tmdb/top_rated_movies_english.csv"))
+        omdb_data = pd.read_csv(Path(self.data_directory, "raw/omdb/data.csv"))
+        keywords = read_records(Path(self.data_directory, "raw/tmdb/keywords"))
+        additional_info = read_records(Path(self.data_directory, "raw/tmdb/additional_info"))
+        genres = read_records(Path(self.data_directory, "raw/tmdb/genres"))
+
+        raw_data = (
+            top_rated_movies[["id", "title", "overview", "genre_ids", "release_date"]]
+            .merge(keywords[["id", "keywords"]], how="left", on="id")
+            .merge(additional_info[["id", "tagline", "imdb_id"]], how="left", on="id")
+            .merge(
+                omdb_data[["imdbID", "Director", "Writer", "Actors"]],
+                how="left",
+                left_on="imdb_id",
+                right_on="imdbID",
+            )
+        )
+
+        genres_map = genres.set_index("id").to_dict()["name"]
+        mapped_genres = (
+            raw_data[["id", "genre_ids"]]
+            .set_index("id")["genre_ids"]
+            .apply(ast.literal_eval)
+            .explode()
+            .replace(genres_map)
+            .astype("str")
+        )
+        genres_column = mapped_genres.groupby(mapped_genres.index).agg(", ".join).reset_index()
+        genre_data = raw_data.merge(genres_column, how="left", on="id", suffixes=("_drop", ""))
+        genre_data = genre_data.drop(["genre_ids_drop", "release_date", "imdb_id", "imdbID"], axis=1)
+        return genre_data.rename(
+            {"Director": "directors", "Writer": "writers", "Actors": "actors", "genre_ids": "genres"}, axis=1
+        )
+
+    def build(self, data: pd.DataFrame) -> pd.DataFrame:
+        chunks = [
+            data.iloc[start : start + self.chunk_size] for start in range(0, len(data), self.chunk_size)
+        ]
+        if self.workers == 1:
+            results = [build_soups(chunk) for chunk in tqdm(chunks, desc="Building soups")]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_setup_worker) as executor:
+                results = list(
+                    tqdm(executor.map(build_soups, chunks), total=len(chunks), desc="Building soups")
+                )
+        return pd.concat(results, ignore_index=True)
+
+    def run(self, compare_sample: int = 0):
+        data = self.load()
+
+        start = time.perf_counter()
+        soup_data = self.build(data)
+        elapsed = time.perf_counter() - start
+        soup_data.to_parquet(self.write_file)
+        print(f"{len(soup_data)} soups written to {self.write_file} in {elapsed:.1f}s")
+
+        if compare_sample:
+            sample = data.head(compare_sample)
+            start = time.perf_counter()
+            expected = build_soups_notebook(sample)
+            notebook_elapsed = (time.perf_counter() - start) * len(data) / len(sample)
+            print(f"Notebook path, extrapolated from {len(sample)} rows: {notebook_elapsed:.1f}s")
+            print(f"Speedup: {notebook_elapsed / elapsed:.1f}x")
+            if not expected.reset_index(drop=True).equals(soup_data.head(len(sample))):
+                print("Warning: pipeline output differs from the notebook path on the sample")
+
+
+def main(
+    data_directory: str = typer.Option(
+        help="Directory holding the raw/ and processed/ data.", default="data"
+    ),
+    workers: int = typer.Option(help="Worker processes, defaults to the number of CPUs.", default=0),
+    chunk_size: int = typer.Option(help="Movies per worker task.", default=500),
+    compare: int = typer.Option(
+        help="Also time the serial notebook path on this many movies and report the speedup.", default=0
+    ),
+):
+    SoupBuilder(data_directory, workers or None, chunk_size).run(compare_sample=compare)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+class CheckpointStore:
+    """Append-only log of completed ids, loaded once into an in-memory set.
+
+    The log is a two column CSV (id, time). ``add`` marks an id as done in memory and ``commit``
+    appends the pending ids to the log, so commit only after their output has been written.
+    """
+
+    def __init__(self, path, header: str = "id,time"):
+        self.path = Path(path)
+        self.header = header
+        self.done: set[str] = set()
+        self.pending: list[str] = []
+
+        if self.path.exists():
+            with open(self.path) as file:
+                lines = file.read().split("\n")
+            # The last element is empty unless a crash left a partial line, which is not trusted
+            self.done.update(line.split(",", 1)[0] for line in lines[1:-1] if line)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(f"{self.header}\n")
+
+    def __contains__(self, id) -> bool:
+        return str(id) in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def remaining(self, ids) -> list:
+        return [id for id in ids if str(id) not in self.done]
+
+    def add(self, id):
+        self.done.add(str(id))
+        self.pending.append(f"{id},{datetime.now()}\n")
+
+    def commit(self):
+        if not self.pending:
+            return
+        with open(self.path, "a") as file:
+            file.write("".join(self.pending))
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending = []
+
+    def clear(self):
+        self.done = set()
+        self.pending = []
+        self.path.write_text(f"{self.header}\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.commit()
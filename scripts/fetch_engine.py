@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from job_metrics import FAILURES, REQUESTS, RETRIES
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+TMDB_BASE_URL = "https://api.themoviedb.org/3"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchEngine:
+    """Concurrent GET requests over one pooled session, rate limited and retried with backoff.
+
+    Requests answered with 429 or 5xx, and connection errors, are retried up to ``max_retries``
+    times, honouring ``Retry-After`` when the server sends it.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str = TMDB_BASE_URL,
+        concurrency: int = 8,
+        rate: float = 40.0,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        timeout: float = 10.0,
+        source: str = "tmdb",
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.source = source
+        self.bucket = TokenBucket(rate)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.requests = 0
+        self.retries = 0
+        self.failed: list = []
+
+    def _delay(self, attempt: int, response: requests.Response | None = None) -> float:
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return float(response.headers["Retry-After"])
+        return self.backoff * 2**attempt * (1 + random.random())
+
+    def get(self, path: str, **params) -> dict:
+        if self.api_key:
+            params["api_key"] = self.api_key
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self.requests += 1
+            REQUESTS.labels(self.source).inc()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                RETRIES.labels(self.source).inc()
+                time.sleep(self._delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                self.retries += 1
+                RETRIES.labels(self.source).inc()
+                time.sleep(self._delay(attempt, response))
+                continue
+
+            response.raise_for_status()
+            return response.json()
+
+        raise requests.RequestException(f"Giving up on {url}")
+
+    def map(self, function, items, desc: str | None = None):
+        """Yield ``(item, function(item))`` as calls complete, skipping items that failed."""
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = {executor.submit(function, item): item for item in items}
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                item = futures[future]
+                try:
+                    yield item, future.result()
+                except requests.RequestException as e:
+                    self.failed.append(item)
+                    FAILURES.labels(self.source).inc()
+                    tqdm.write(f"Failed to fetch {item}: {e}")
+        finally:
+            # On interrupt, drop the queued requests instead of draining them
+            executor.shutdown(cancel_futures=True)
+
+    def close(self):
+        self.session.close()
@@ -1,13 +1,56 @@
+import asyncio
+import hashlib
 import json
 import os
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 from pathlib import Path
 
 import pandas as pd
 import requests
 import typer
+from checkpoint import CheckpointStore
+from job_metrics import FAILURES, KEYS_DROPPED, REQUESTS, ROWS_WRITTEN, JobMetrics
+from requests.adapters import HTTPAdapter
+from sink import RecordSink
 from tqdm import tqdm
 
+OMDB_COLUMNS = [
+    "Title",
+    "Year",
+    "Rated",
+    "Released",
+    "Runtime",
+    "Genre",
+    "Director",
+    "Writer",
+    "Actors",
+    "Plot",
+    "Language",
+    "Country",
+    "Awards",
+    "Poster",
+    "Ratings",
+    "Metascore",
+    "imdbRating",
+    "imdbVotes",
+    "imdbID",
+    "Type",
+    "DVD",
+    "BoxOffice",
+    "Production",
+    "Website",
+    "Response",
+    "Time",
+]
+
+
+def is_relevant(data: dict) -> bool:
+    if data["Response"] != "True":
+        return False
+    languages = data["Language"].split(", ")
+    return data["Type"] == "movie" and ("English" in languages or "Portuguese" in languages)
+
 
 class OMDBClient:
     def __init__(self, api_key, data_directory: str = "data", batch_size: int = 50):
@@ -26,54 +69,20 @@ class OMDBClient:
         self.omdb_file = Path(self.data_directory, "raw/omdb", "data.csv")
 
         self.relevant_titles = pd.read_parquet(self.relevant_titles_file)
-
-        if not os.path.exists(self.processed_titles_file):
-            dataframe = pd.DataFrame(columns=["imdb_id", "time"])
-            dataframe.to_csv(self.processed_titles_file, index=False)
+        self.processed_titles = CheckpointStore(self.processed_titles_file, header="imdb_id,time")
 
         if not os.path.exists(self.omdb_file):
-            dataframe = pd.DataFrame(
-                columns=[
-                    "Title",
-                    "Year",
-                    "Rated",
-                    "Released",
-                    "Runtime",
-                    "Genre",
-                    "Director",
-                    "Writer",
-                    "Actors",
-                    "Plot",
-                    "Language",
-                    "Country",
-                    "Awards",
-                    "Poster",
-                    "Ratings",
-                    "Metascore",
-                    "imdbRating",
-                    "imdbVotes",
-                    "imdbID",
-                    "Type",
-                    "DVD",
-                    "BoxOffice",
-                    "Production",
-                    "Website",
-                    "Response",
-                    "Time",
-                ]
-            )
+            dataframe = pd.DataFrame(columns=OMDB_COLUMNS)
             dataframe.to_csv(self.omdb_file, index=False)
 
-    def __select_current_titles(self):
-        self.relevant_titles = self.relevant_titles[
-            ~self.relevant_titles["imdb_id"].isin(self.processed_titles["imdb_id"])
-        ]
-
-        self.current_titles = self.relevant_titles.sample(min(self.batch_size, len(self.relevant_titles)))
+    def _select_pending_titles(self):
+        titles = self.relevant_titles["imdb_id"].sample(frac=1).tolist()
+        self.pending_titles = self.processed_titles.remaining(titles)
 
     def __make_request(self, imdb_id: str):
         data_response = requests.get(f"http://www.omdbapi.com/?apikey={self.api_key}&i={imdb_id}&plot=full")
         self.requests += 1
+        REQUESTS.labels("omdb").inc()
 
         if data_response.status_code == 200:
             data = json.loads(data_response.text)
@@ -87,41 +96,40 @@ class OMDBClient:
 
     def __write_to_file(self):
         if len(self.write_info):
-            titles = [{"title": id, "time": data["time"]} for id, data in self.write_info.items()]
-
             write_data = []
             write_titles = []
             for data in self.write_info.values():
-                if data["data"]["Response"] == "True":
-                    languages = data["data"]["Language"].split(", ")
-                    type = data["data"]["Type"]
-                    if type == "movie" and ("English" in languages or "Portuguese" in languages):
-                        data["data"].update({"Time": data["time"]})
-                        write_data.append(data["data"])
-                        write_titles.append(data["data"]["imdbID"])
+                if is_relevant(data["data"]):
+                    data["data"].update({"Time": data["time"]})
+                    write_data.append(data["data"])
+                    write_titles.append(data["data"]["imdbID"])
 
             omdb_data = pd.DataFrame(write_data)
             omdb_data.to_csv(self.omdb_file, mode="a", header=False, index=False)
+            ROWS_WRITTEN.labels("omdb").inc(len(omdb_data))
 
-            omdb_titles = pd.DataFrame(titles)
-            omdb_titles.to_csv(self.processed_titles_file, mode="a", header=False, index=False)
+            for id in self.write_info:
+                self.processed_titles.add(id)
+            self.processed_titles.commit()
 
             self.write_info = {}
 
     def run(self, requests_limit: int = 100):
         self.write_info = {}
+        self._select_pending_titles()
+
+        for start in range(0, len(self.pending_titles), self.batch_size):
+            if self.requests >= requests_limit:
+                break
 
-        while self.requests < requests_limit and len(self.relevant_titles):
             try:
-                self.processed_titles = pd.read_csv(self.processed_titles_file)
-                self.__select_current_titles()
+                current_titles = self.pending_titles[start : start + self.batch_size]
 
-                for title in tqdm(
-                    self.current_titles.itertuples(),
+                for current_title in tqdm(
+                    current_titles,
                     desc=f"Downloading... Current requisition - {self.requests}",
-                    total=self.batch_size,
+                    total=len(current_titles),
                 ):
-                    current_title = title.imdb_id
                     result = self.__make_request(current_title)
                     result["time"] = datetime.now()
                     self.write_info[current_title] = result
@@ -133,10 +141,166 @@ class OMDBClient:
                 break
 
 
-def main():
+class KeyQuota:
+    """Requests made today with each API key, persisted so that runs on the same day share it.
+
+    Keys are stored by a fingerprint, never in clear.
+    """
+
+    def __init__(self, api_keys: list[str], daily_quota: int, path):
+        self.api_keys = api_keys
+        self.daily_quota = daily_quota
+        self.path = Path(path)
+
+        self.used = {}
+        if self.path.exists():
+            state = json.loads(self.path.read_text())
+            if state["date"] == date.today().isoformat():
+                self.used = state["used"]
+
+    @staticmethod
+    def _fingerprint(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+    def acquire(self) -> str | None:
+        """The key with the most requests left, counting one request against it."""
+        remaining = {
+            key: self.daily_quota - self.used.get(self._fingerprint(key), 0) for key in self.api_keys
+        }
+        api_key = max(remaining, key=lambda key: remaining[key])
+        if remaining[api_key] <= 0:
+            return None
+        self.used[self._fingerprint(api_key)] = self.used.get(self._fingerprint(api_key), 0) + 1
+        return api_key
+
+    def exhaust(self, api_key: str) -> bool:
+        """Take ``api_key`` out of rotation, returning False when it already was."""
+        fingerprint = self._fingerprint(api_key)
+        dropped = self.used.get(fingerprint, 0) < self.daily_quota
+        self.used[fingerprint] = self.daily_quota
+        return dropped
+
+    def save(self):
+        self.path.write_text(json.dumps({"date": date.today().isoformat(), "used": self.used}))
+
+
+class AsyncOMDBClient(OMDBClient):
+    """OMDBClient with ``concurrency`` requests in flight over one pooled session.
+
+    Responses are filtered and written as they arrive, so memory does not grow with the run.
+    Requests are spread over ``api_keys`` within ``daily_quota`` requests per key and day.
+    """
+
+    URL = "http://www.omdbapi.com/"
+
+    def __init__(
+        self,
+        api_keys: list[str],
+        data_directory: str = "data",
+        batch_size: int = 50,
+        concurrency: int = 10,
+        daily_quota: int = 1000,
+    ):
+        super().__init__(api_keys[0], data_directory, batch_size)
+        self.concurrency = concurrency
+        self.quota = KeyQuota(api_keys, daily_quota, Path(self.data_directory, "interim", "omdb_quota.json"))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Sized like the pool: the default executor of asyncio.to_thread has min(32, cpus + 4) threads
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="omdb")
+
+    def _get(self, api_key: str, imdb_id: str) -> requests.Response:
+        return self.session.get(
+            self.URL, params={"apikey": api_key, "i": imdb_id, "plot": "full"}, timeout=10
+        )
+
+    async def _fetch(self, imdb_id: str) -> dict | None:
+        while (api_key := self.quota.acquire()) is not None:
+            response = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._get, api_key, imdb_id
+            )
+            self.requests += 1
+            REQUESTS.labels("omdb").inc()
+            # OMDB answers 401 both for an exhausted and for an invalid key
+            if response.status_code == 401:
+                # Requests already in flight with the key get 401 too, count the key once
+                if self.quota.exhaust(api_key):
+                    tqdm.write(f"Dropping an API key: {response.json().get('Error')}")
+                    KEYS_DROPPED.labels("omdb").inc()
+                continue
+            response.raise_for_status()
+            return response.json()
+        return None
+
+    async def _worker(self, titles, sink: RecordSink, progress_bar):
+        for imdb_id in titles:
+            try:
+                data = await self._fetch(imdb_id)
+            except requests.exceptions.RequestException as e:
+                tqdm.write(f"Failed to fetch {imdb_id}: {e}")
+                FAILURES.labels("omdb").inc()
+                continue
+            if data is None:
+                return
+
+            if is_relevant(data):
+                data["Time"] = datetime.now()
+                sink.write({column: data.get(column) for column in OMDB_COLUMNS})
+            self.processed_titles.add(imdb_id)
+            if len(self.processed_titles.pending) >= self.batch_size:
+                sink.flush()
+                self.processed_titles.commit()
+            progress_bar.update(1)
+
+    async def run_async(self, requests_limit: int = 100):
+        self._select_pending_titles()
+        # One iterator shared by the workers, so only ``concurrency`` titles are in flight
+        titles = iter(self.pending_titles[:requests_limit])
+
+        try:
+            with (
+                self.processed_titles,
+                RecordSink(self.omdb_file.with_suffix(""), "csv", self.batch_size, dataset="omdb") as sink,
+                tqdm(total=min(requests_limit, len(self.pending_titles)), desc="Downloading") as progress_bar,
+            ):
+                await asyncio.gather(
+                    *(self._worker(titles, sink, progress_bar) for _ in range(self.concurrency))
+                )
+        finally:
+            self.quota.save()
+            self.executor.shutdown(cancel_futures=True)
+            self.session.close()
+
+    def run(self, requests_limit: int = 100):
+        asyncio.run(self.run_async(requests_limit))
+
+
+def main(
+    use_async: bool = typer.Option(
+        False,
+        "--async/--no-async",
+        help="Use the concurrent client, with OMDB_API_KEY as comma separated keys.",
+    ),
+    concurrency: int = typer.Option(help="Requests in flight at once with --async.", default=10),
+    daily_quota: int = typer.Option(help="Requests per API key and day with --async.", default=1000),
+    metrics_file: str = typer.Option(
+        help="Write the run's Prometheus metrics to this .prom file for the node exporter.", default=None
+    ),
+):
     api_key = os.environ.get("OMDB_API_KEY")
-    client = OMDBClient(api_key=api_key)
-    client.run(requests_limit=10000)
+    client: OMDBClient
+    if use_async:
+        api_keys = [key for key in (api_key or "").split(",") if key]
+        if not api_keys:
+            raise typer.BadParameter("OMDB_API_KEY must hold at least one key", param_hint="--async")
+        client = AsyncOMDBClient(api_keys, concurrency=concurrency, daily_quota=daily_quota)
+    else:
+        client = OMDBClient(api_key=api_key)
+    with JobMetrics("get_data_from_omdb", metrics_file):
+        client.run(requests_limit=10000)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, write_to_textfile
+
+# Batch jobs have no endpoint to scrape: their metrics are written for the node exporter textfile collector
+REGISTRY = CollectorRegistry()
+
+REQUESTS = Counter(
+    "flickpicks_fetch_requests_total", "HTTP requests sent, retries included.", ["source"], registry=REGISTRY
+)
+RETRIES = Counter(
+    "flickpicks_fetch_retries_total",
+    "Requests retried after a 429, 5xx or connection error.",
+    ["source"],
+    registry=REGISTRY,
+)
+KEYS_DROPPED = Counter(
+    "flickpicks_fetch_keys_dropped_total",
+    "API keys dropped for the rest of the run after the API refused them.",
+    ["source"],
+    registry=REGISTRY,
+)
+FAILURES = Counter(
+    "flickpicks_fetch_failures_total", "Items given up on after retries.", ["source"], registry=REGISTRY
+)
+ROWS_WRITTEN = Counter(
+    "flickpicks_rows_written_total", "Records written to the output datasets.", ["dataset"], registry=REGISTRY
+)
+FETCH_RATE = Gauge(
+    "flickpicks_fetch_rate", "Requests per second over the last run.", ["source"], registry=REGISTRY
+)
+JOB_DURATION = Gauge(
+    "flickpicks_job_duration_seconds", "Duration of the last run.", ["job"], registry=REGISTRY
+)
+JOB_LAST_SUCCESS = Gauge(
+    "flickpicks_job_last_success_timestamp_seconds",
+    "End of the last successful run.",
+    ["job"],
+    registry=REGISTRY,
+)
+
+
+class JobMetrics:
+    """Times a batch job and writes the registry to ``path`` when it ends, if a path is given.
+
+    ``write_to_textfile`` renames a temporary file into place, so the collector never reads a
+    partial file.
+    """
+
+    def __init__(self, job: str, path: str | None = None):
+        self.job = job
+        self.path = path
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        elapsed = time.monotonic() - self.start
+        JOB_DURATION.labels(self.job).set(elapsed)
+        for sample in REQUESTS.collect()[0].samples:
+            if sample.name.endswith("_total"):
+                FETCH_RATE.labels(sample.labels["source"]).set(sample.value / max(elapsed, 1e-9))
+        if exc_type is None:
+            JOB_LAST_SUCCESS.labels(self.job).set_to_current_time()
+        if self.path:
+            write_to_textfile(self.path, REGISTRY)
@@ -0,0 +1,91 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from job_metrics import ROWS_WRITTEN
+
+FORMATS = ("parquet", "csv")
+
+
+class RecordSink:
+    """Buffers records and writes them in batches.
+
+    ``parquet`` writes one part file per batch into the ``<path>.parquet`` directory and keeps
+    list columns as native lists; ``csv`` appends to ``<path>.csv``. With ``overwrite`` what
+    previous runs wrote is removed first, so re-running a fetch does not duplicate its records.
+    Use it as a context manager so the buffer is flushed even when the run is interrupted.
+    """
+
+    def __init__(
+        self,
+        path,
+        output_format: str = "parquet",
+        batch_size: int = 1000,
+        schema=None,
+        dataset: str | None = None,
+        overwrite: bool = False,
+    ):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format {output_format!r}, expected one of {FORMATS}")
+        self.output_format = output_format
+        self.path = Path(f"{path}.{output_format}")
+        self.batch_size = batch_size
+        self.schema = schema
+        self.dataset = dataset or Path(path).name
+        self.buffer: list[dict] = []
+        self.written = 0
+
+        if output_format == "parquet":
+            self.path.mkdir(parents=True, exist_ok=True)
+            if overwrite:
+                for part in self.path.glob("part-*.parquet"):
+                    part.unlink()
+            self.parts = len(list(self.path.glob("part-*.parquet")))
+        elif overwrite:
+            self.path.unlink(missing_ok=True)
+
+    def write(self, record: dict):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        if self.output_format == "parquet":
+            table = pa.Table.from_pylist(self.buffer, schema=self.schema)
+            # Write under a temporary name so an interrupted flush never leaves a partial part
+            part = Path(self.path, f"part-{self.parts:05d}.parquet")
+            temporary = part.with_suffix(".tmp")
+            pq.write_table(table, temporary)
+            os.replace(temporary, part)
+            self.parts += 1
+        else:
+            dataframe = pd.DataFrame(self.buffer)
+            dataframe.to_csv(self.path, mode="a", header=not self.path.exists(), index=False)
+
+        self.written += len(self.buffer)
+        ROWS_WRITTEN.labels(self.dataset).inc(len(self.buffer))
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def read_records(path) -> pd.DataFrame:
+    """Read what a ``RecordSink`` wrote to ``path``, in either format."""
+    parts = sorted(Path(f"{path}.parquet").glob("part-*.parquet"))
+    if parts:
+        table = pa.concat_tables([pq.read_table(part) for part in parts], promote_options="default")
+        return table.to_pandas()
+    return pd.read_csv(f"{path}.csv")
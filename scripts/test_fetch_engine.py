@@ -0,0 +1,359 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import requests
+from checkpoint import CheckpointStore
+from fetch_engine import FetchEngine
+from get_data_from_omdb import AsyncOMDBClient, KeyQuota
+from job_metrics import REGISTRY
+from sink import RecordSink, read_records
+from tmdb_fetcher import TMDBMovieProvidersFetcher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.paths.append(self.path)
+            script = server.scripts.get(server.route(self.path), [])
+            status, headers, *body = script.pop(0) if len(script) > 1 else script[0]
+        body = json.dumps(body[0] if body else {"path": self.path}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Answers each path with its scripted ``(status, headers)`` or ``(status, headers, body)``
+    responses, repeating the last one. Bodies default to ``{"path": <requested path>}``.
+    ``route`` maps a requested path to its script, by default by dropping the query.
+    """
+
+    def __init__(self, scripts, route=None):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.scripts = {path: list(script) for path, script in scripts.items()}
+        self.route = route or (lambda path: urlsplit(path).path)
+        self.paths = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+def serve(test, scripts, route=None):
+    """Stub server running until ``test`` is cleaned up."""
+    server = StubServer(scripts, route)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    test.addCleanup(thread.join)
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server
+
+
+class FetchEngineTests(unittest.TestCase):
+    def engine(self, server, **options):
+        engine = FetchEngine(
+            api_key="key", base_url=server.url, rate=1000, backoff=0.05, source="stub", **options
+        )
+        self.addCleanup(engine.close)
+        return engine
+
+    def test_retries_rate_limited_requests(self):
+        server = serve(self, {"/movie/1": [(429, {"Retry-After": "0"})] * 2 + [(200, {})]})
+        engine = self.engine(server)
+        retries = REGISTRY.get_sample_value("flickpicks_fetch_retries_total", {"source": "stub"}) or 0
+
+        self.assertEqual(engine.get("movie/1", page=2), {"path": "/movie/1?page=2&api_key=key"})
+        self.assertEqual(engine.requests, 3)
+        self.assertEqual(engine.retries, 2)
+        self.assertEqual(len(server.paths), 3)
+        self.assertEqual(
+            REGISTRY.get_sample_value("flickpicks_fetch_retries_total", {"source": "stub"}), retries + 2
+        )
+
+    def test_honours_retry_after(self):
+        server = serve(self, {"/movie/1": [(429, {"Retry-After": "1"}), (200, {})]})
+        engine = self.engine(server)
+        start = time.monotonic()
+        engine.get("movie/1")
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(engine.retries, 1)
+
+    def test_backs_off_exponentially_without_retry_after(self):
+        server = serve(self, {"/movie/1": [(503, {}), (502, {}), (200, {})]})
+        engine = self.engine(server)
+        start = time.monotonic()
+        engine.get("movie/1")
+        # At least backoff * (1 + 2), and below twice that with the jitter
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.15)
+        self.assertLess(elapsed, 0.3 + 0.5)
+        self.assertEqual(engine.retries, 2)
+
+    def test_gives_up_after_max_retries(self):
+        server = serve(self, {"/movie/1": [(503, {"Retry-After": "0"})]})
+        engine = self.engine(server, max_retries=2)
+        with self.assertRaises(requests.HTTPError) as raised:
+            engine.get("movie/1")
+        self.assertEqual(raised.exception.response.status_code, 503)
+        self.assertEqual(len(server.paths), 3)
+        self.assertEqual(engine.retries, 2)
+
+    def test_does_not_retry_client_errors(self):
+        server = serve(self, {"/movie/1": [(404, {})]})
+        engine = self.engine(server)
+        with self.assertRaises(requests.HTTPError):
+            engine.get("movie/1")
+        self.assertEqual(len(server.paths), 1)
+        self.assertEqual(engine.retries, 0)
+
+    def test_retries_connection_errors(self):
+        server = serve(self, {})
+        engine = FetchEngine(base_url=server.url, rate=1000, max_retries=1, backoff=0.01, source="stub")
+        self.addCleanup(engine.close)
+        server.shutdown()
+        server.server_close()
+        with self.assertRaises(requests.ConnectionError):
+            engine.get("movie/1")
+        self.assertEqual(engine.requests, 2)
+        self.assertEqual(engine.retries, 1)
+
+    def test_map_skips_failed_items(self):
+        server = serve(
+            self,
+            {
+                "/movie/1": [(200, {})],
+                "/movie/2": [(404, {})],
+                "/movie/3": [(429, {"Retry-After": "0"}), (200, {})],
+            },
+        )
+        engine = self.engine(server, concurrency=3)
+        results = dict(engine.map(lambda movie_id: engine.get(f"movie/{movie_id}"), [1, 2, 3]))
+        self.assertEqual(sorted(results), [1, 3])
+        self.assertEqual(results[3], {"path": "/movie/3?api_key=key"})
+        self.assertEqual(engine.failed, [2])
+
+
+class RecordSinkTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, "movies")
+
+    def records(self, start, stop):
+        return [{"id": id, "genre_ids": [id, id + 1]} for id in range(start, stop)]
+
+    def test_parquet_writes_one_part_per_batch(self):
+        written = REGISTRY.get_sample_value("flickpicks_rows_written_total", {"dataset": "movies"}) or 0
+        with RecordSink(self.path, batch_size=4) as sink:
+            sink.write_many(self.records(0, 10))
+            self.assertEqual(len(list(Path(f"{self.path}.parquet").glob("part-*.parquet"))), 2)
+            self.assertEqual(len(sink.buffer), 2)
+        # Nothing but the finished parts is left in the directory
+        parts = sorted(path.name for path in Path(f"{self.path}.parquet").iterdir())
+        self.assertEqual(parts, [f"part-{part:05d}.parquet" for part in range(3)])
+        self.assertEqual(sink.written, 10)
+        self.assertEqual(
+            REGISTRY.get_sample_value("flickpicks_rows_written_total", {"dataset": "movies"}), written + 10
+        )
+        records = read_records(self.path)
+        self.assertEqual(records["id"].tolist(), list(range(10)))
+        # List columns stay native lists
+        self.assertEqual(list(records["genre_ids"].iloc[3]), [3, 4])
+
+    def test_interrupted_runs_flush_their_buffer(self):
+        with self.assertRaises(KeyboardInterrupt):
+            with RecordSink(self.path, batch_size=100) as sink:
+                sink.write_many(self.records(0, 5))
+                raise KeyboardInterrupt
+        self.assertEqual(read_records(self.path)["id"].tolist(), list(range(5)))
+
+    def test_runs_append_new_parts_unless_overwriting(self):
+        with RecordSink(self.path, batch_size=4) as sink:
+            sink.write_many(self.records(0, 6))
+        with RecordSink(self.path, batch_size=4) as sink:
+            sink.write_many(self.records(6, 8))
+        self.assertEqual(read_records(self.path)["id"].tolist(), list(range(8)))
+
+        with RecordSink(self.path, batch_size=4, overwrite=True) as sink:
+            sink.write_many(self.records(20, 23))
+        self.assertEqual(read_records(self.path)["id"].tolist(), [20, 21, 22])
+
+    def test_csv_appends_with_one_header(self):
+        for start, stop in ((0, 3), (3, 7)):
+            with RecordSink(self.path, "csv", batch_size=2) as sink:
+                sink.write_many(self.records(start, stop))
+        self.assertEqual(read_records(self.path)["id"].tolist(), list(range(7)))
+
+        with RecordSink(self.path, "csv", overwrite=True) as sink:
+            sink.write_many(self.records(10, 12))
+        self.assertEqual(read_records(self.path)["id"].tolist(), [10, 11])
+
+    def test_unknown_formats_are_rejected(self):
+        with self.assertRaises(ValueError):
+            RecordSink(self.path, "json")
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.path = Path(self.directory, "checkpoints", "movies.csv")
+
+    def test_committed_ids_survive_a_restart(self):
+        with CheckpointStore(self.path) as checkpoint:
+            checkpoint.add(1)
+            checkpoint.add("2")
+        checkpoint = CheckpointStore(self.path)
+        self.assertIn(1, checkpoint)
+        self.assertIn("1", checkpoint)
+        self.assertEqual(len(checkpoint), 2)
+        self.assertEqual(checkpoint.remaining([1, 2, 3, 4]), [3, 4])
+
+    def test_uncommitted_and_partial_lines_are_not_trusted(self):
+        checkpoint = CheckpointStore(self.path)
+        checkpoint.add(1)
+        checkpoint.commit()
+        checkpoint.add(2)
+        # A crash in the middle of an append
+        with open(self.path, "a") as file:
+            file.write("3,2024-01")
+        self.assertEqual(CheckpointStore(self.path).remaining([1, 2, 3]), [2, 3])
+
+    def test_clear_forgets_every_id(self):
+        with CheckpointStore(self.path) as checkpoint:
+            checkpoint.add(1)
+        CheckpointStore(self.path).clear()
+        self.assertEqual(len(CheckpointStore(self.path)), 0)
+        self.assertEqual(self.path.read_text(), "id,time\n")
+
+    def fetch_providers(self, server, resume=True):
+        engine = FetchEngine(base_url=server.url, rate=1000, max_retries=0, source="stub")
+        self.addCleanup(engine.close)
+        TMDBMovieProvidersFetcher(self.directory, engine, resume=resume).run()
+        return sorted(read_records(Path(self.directory, "movie_providers"))["id"].tolist())
+
+    def test_fetches_resume_after_the_last_committed_movie(self):
+        def providers(id):
+            body = {"id": id, "results": {"BR": {"link": "link", "flatrate": [{"provider_id": 8}]}}}
+            return [(200, {}, body)]
+
+        with RecordSink(Path(self.directory, "top_rated_movies")) as sink:
+            sink.write_many({"id": id} for id in (1, 2, 3))
+        server = serve(
+            self,
+            {
+                "/movie/1/watch/providers": providers(1),
+                "/movie/2/watch/providers": [(404, {})],
+                "/movie/3/watch/providers": providers(3),
+            },
+        )
+        self.assertEqual(self.fetch_providers(server), [1, 3])
+
+        server.scripts["/movie/2/watch/providers"] = providers(2)
+        server.paths.clear()
+        self.assertEqual(self.fetch_providers(server), [1, 2, 3])
+        self.assertEqual(server.paths, ["/movie/2/watch/providers"])
+
+        # Without resuming every movie is fetched again and the previous output replaced
+        server.paths.clear()
+        self.assertEqual(self.fetch_providers(server, resume=False), [1, 2, 3])
+        self.assertEqual(len(server.paths), 3)
+
+
+class OMDBTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.quota_path = Path(self.directory, "quota.json")
+
+    def test_keys_with_the_most_requests_left_go_first(self):
+        quota = KeyQuota(["a", "b"], 3, self.quota_path)
+        self.assertEqual([quota.acquire() for _ in range(7)], ["a", "b", "a", "b", "a", "b", None])
+
+    def test_usage_is_shared_by_the_runs_of_a_day(self):
+        quota = KeyQuota(["secret-key"], 3, self.quota_path)
+        quota.acquire()
+        quota.save()
+        self.assertNotIn("secret-key", self.quota_path.read_text())
+        self.assertEqual(
+            [KeyQuota(["secret-key"], 3, self.quota_path).acquire() for _ in range(2)], ["secret-key"] * 2
+        )
+
+        state = json.loads(self.quota_path.read_text())
+        self.quota_path.write_text(json.dumps({**state, "date": "2000-01-01"}))
+        quota = KeyQuota(["secret-key"], 3, self.quota_path)
+        self.assertEqual([quota.acquire() for _ in range(4)], ["secret-key"] * 3 + [None])
+
+    def test_exhausted_keys_are_dropped_once(self):
+        quota = KeyQuota(["a", "b"], 3, self.quota_path)
+        self.assertTrue(quota.exhaust("a"))
+        self.assertFalse(quota.exhaust("a"))
+        self.assertEqual([quota.acquire() for _ in range(4)], ["b", "b", "b", None])
+
+    def client(self, server, api_keys, titles, **options):
+        Path(self.directory, "processed").mkdir()
+        Path(self.directory, "raw", "omdb").mkdir(parents=True)
+        pd.DataFrame({"imdb_id": titles}).to_parquet(
+            Path(self.directory, "processed", "relevant_titles.parquet")
+        )
+        client = AsyncOMDBClient(api_keys, str(self.directory), batch_size=5, **options)
+        client.URL = f"{server.url}/"
+        return client
+
+    def omdb_server(self, scripts):
+        movie = {"Response": "True", "Language": "English, Portuguese", "Type": "movie", "imdbID": "tt0"}
+        return serve(
+            self,
+            {
+                key: [(status, {}, movie if status == 200 else {"Error": "Invalid API key!"})]
+                for key, status in scripts.items()
+            },
+            route=lambda path: parse_qs(urlsplit(path).query)["apikey"][0],
+        )
+
+    def test_refused_keys_are_dropped_and_counted_once(self):
+        server = self.omdb_server({"bad": 401, "good": 200})
+        titles = [f"tt{index}" for index in range(20)]
+        client = self.client(server, ["bad", "good"], titles, concurrency=8, daily_quota=100)
+        dropped = REGISTRY.get_sample_value("flickpicks_fetch_keys_dropped_total", {"source": "omdb"}) or 0
+
+        client.run(requests_limit=len(titles))
+        self.assertEqual(
+            REGISTRY.get_sample_value("flickpicks_fetch_keys_dropped_total", {"source": "omdb"}), dropped + 1
+        )
+        self.assertEqual(len(client.processed_titles), 20)
+        self.assertEqual(len(pd.read_csv(client.omdb_file)), 20)
+        self.assertEqual(CheckpointStore(client.processed_titles_file).remaining(titles), [])
+
+    def test_runs_stop_at_the_daily_quota(self):
+        server = self.omdb_server({"good": 200})
+        titles = [f"tt{index}" for index in range(20)]
+        client = self.client(server, ["good"], titles, concurrency=4, daily_quota=6)
+
+        client.run(requests_limit=len(titles))
+        self.assertEqual(len(server.paths), 6)
+        self.assertEqual(len(CheckpointStore(client.processed_titles_file)), 6)
+        self.assertIsNone(KeyQuota(["good"], 6, client.quota.path).acquire())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,26 +1,57 @@
-import json
 import os
 from pathlib import Path
 
-import pandas as pd
-import requests
-import tmdbsimple as tmdb
+import pyarrow as pa
 import typer
+from checkpoint import CheckpointStore
+from fetch_engine import TMDB_BASE_URL, FetchEngine
+from job_metrics import JobMetrics
+from sink import FORMATS, RecordSink, read_records
 from tqdm import tqdm
 
 API_KEY = os.environ.get("TMDB_API_KEY")
 
 
 class BaseFetcher:
-    tmdb.API_KEY = API_KEY
     LANGUAGE = "pt-BR"
     REGION = "BR"
+    CHECKPOINT_EVERY = 500
+
+    def __init__(
+        self,
+        data_directory: str,
+        engine: FetchEngine | None = None,
+        output_format: str = "parquet",
+        resume: bool = True,
+    ):
+        self.data_directory = Path(data_directory)
+        self.engine = engine or FetchEngine(API_KEY)
+        self.output_format = output_format
+        self.resume = resume
+
+    def _sink(self, name: str, schema=None, overwrite: bool | None = None):
+        """Sink of ``name``, replacing the previous output unless the run resumes it."""
+        overwrite = not self.resume if overwrite is None else overwrite
+        return RecordSink(
+            Path(self.data_directory, name), self.output_format, schema=schema, overwrite=overwrite
+        )
+
+    def _checkpoint(self, name: str):
+        checkpoint = CheckpointStore(Path(self.data_directory, "checkpoints", f"{name}.csv"))
+        if not self.resume:
+            checkpoint.clear()
+        return checkpoint
+
+    def _commit(self, checkpoint: CheckpointStore, *sinks: RecordSink):
+        """Flush ``sinks`` and then commit their ids, so a crash can only cause refetches."""
+        if len(checkpoint.pending) >= self.CHECKPOINT_EVERY:
+            for sink in sinks:
+                sink.flush()
+            checkpoint.commit()
 
-    def _write_to_file(self, file, data):
-        if os.path.exists(file):
-            data.to_csv(file, mode="a", header=False, index=False)
-        else:
-            data.to_csv(file, index=False)
+    def _select_ids(self, checkpoint: CheckpointStore):
+        selected_titles = read_records(Path(self.data_directory, "top_rated_movies"))
+        return checkpoint.remaining(selected_titles["id"].tolist())
 
     def run(self):
         pass
@@ -29,113 +60,108 @@ class BaseFetcher:
 class TMDBTopRatedMoviesFetcher(BaseFetcher):
     MAX_PAGES = 1000
 
-    def __init__(self, data_directory: str):
-        self.write_file = Path(data_directory, "top_rated_movies.csv")
-        self.movies = tmdb.Movies()
+    def __fetch_page(self, page: int):
+        return self.engine.get("movie/top_rated", page=page, language=self.LANGUAGE, region=self.REGION)
 
     def run(self):
-        top = self.movies.top_rated(page=1, language=self.LANGUAGE, region=self.REGION)
-
-        for page in tqdm(range(1, top["total_pages"] + 1), desc="Fetching top rated movies"):
-            if page != 1:
-                top = self.movies.top_rated(page=page, language=self.LANGUAGE, region=self.REGION)
+        top = self.__fetch_page(1)
+        pages = {1: top}
+        pages.update(
+            self.engine.map(
+                self.__fetch_page, range(2, top["total_pages"] + 1), desc="Fetching top rated movies"
+            )
+        )
 
-            dataframe = pd.DataFrame(top["results"])
-            self._write_to_file(self.write_file, dataframe)
+        # Pages complete out of order, the file keeps the ranking order
+        with self._sink("top_rated_movies", overwrite=True) as sink:
+            for page in sorted(pages):
+                sink.write_many(pages[page]["results"])
 
 
 class TMDBMovieProvidersFetcher(BaseFetcher):
-    def __init__(self, data_directory: str):
-        self.selected_titles_file = Path(data_directory, "top_rated_movies.csv")
-        self.write_file = Path(data_directory, "movie_providers.csv")
-
-    def __select_ids(self):
-        selected_titles = pd.read_csv(self.selected_titles_file)
-        self.selected_ids = selected_titles["id"].values
-
-    def __fetch_movie_providers(self, id: int):
-        movies = tmdb.Movies(id)
-        providers = movies.watch_providers()
+    SCHEMA = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("link", pa.string()),
+            ("transaction_type", pa.string()),
+            ("provider_id", pa.int64()),
+        ]
+    )
 
-        data = []
+    @classmethod
+    def parse(cls, providers: dict):
+        data: list[dict] = []
 
-        if self.REGION not in providers["results"]:
-            return
+        if cls.REGION not in providers["results"]:
+            return data
 
-        types = list(providers["results"][self.REGION].keys())
+        types = list(providers["results"][cls.REGION].keys())
         types.remove("link")
 
         for transaction_type in types:
-            for provider_data in providers["results"][self.REGION][transaction_type]:
+            for provider_data in providers["results"][cls.REGION][transaction_type]:
                 current_data = {
                     "id": providers["id"],
-                    "link": providers["results"][self.REGION]["link"],
+                    "link": providers["results"][cls.REGION]["link"],
                     "transaction_type": transaction_type,
                     "provider_id": provider_data["provider_id"],
                 }
 
                 data.append(current_data)
 
-        dataframe = pd.DataFrame(data)
-        self._write_to_file(self.write_file, dataframe)
+        return data
+
+    def __fetch_movie_providers(self, id: int):
+        return self.parse(self.engine.get(f"movie/{id}/watch/providers"))
 
     def run(self):
-        self.__select_ids()
-        for id in tqdm(self.selected_ids, desc="Fetching movie providers"):
-            self.__fetch_movie_providers(id)
+        with (
+            self._checkpoint("movie_providers") as checkpoint,
+            self._sink("movie_providers", self.SCHEMA) as sink,
+        ):
+            for id, data in self.engine.map(
+                self.__fetch_movie_providers, self._select_ids(checkpoint), desc="Fetching movie providers"
+            ):
+                sink.write_many(data)
+                checkpoint.add(id)
+                self._commit(checkpoint, sink)
 
 
 class TMDBProvidersFetcher(BaseFetcher):
-    def __init__(self, data_directory: str):
-        self.write_file = Path(data_directory, "providers.csv")
-        self.url = (
-            "https://api.themoviedb.org/3/watch/providers/movie?"
-            f"language={self.LANGUAGE}&watch_region={self.REGION}&api_key={API_KEY}"
-        )
-
     def run(self):
-        response = requests.get(self.url)
-        result = json.loads(response.text)
+        result = self.engine.get("watch/providers/movie", language=self.LANGUAGE, watch_region=self.REGION)
 
-        data = []
-
-        for provider in tqdm(result["results"], desc="Fetching providers"):
-            current_provider = {key: provider[key] for key in ["logo_path", "provider_name", "provider_id"]}
-
-            data.append(current_provider)
-
-        dataframe = pd.DataFrame(data)
-        self._write_to_file(self.write_file, dataframe)
+        with self._sink("providers", overwrite=True) as sink:
+            for provider in tqdm(result["results"], desc="Fetching providers"):
+                sink.write({key: provider[key] for key in ["logo_path", "provider_name", "provider_id"]})
 
 
 class TMDBGenresFetcher(BaseFetcher):
-    def __init__(self, data_directory: str):
-        self.write_file = Path(data_directory, "genres.csv")
-
     def run(self):
         with tqdm(total=1, desc="Fetching genres") as progress_bar:
-            genres = tmdb.Genres()
-            genres_list = genres.movie_list()
-            dataframe = pd.DataFrame(genres_list["genres"])
+            genres_list = self.engine.get("genre/movie/list")
 
-            self._write_to_file(self.write_file, dataframe)
+            with self._sink("genres", overwrite=True) as sink:
+                sink.write_many(genres_list["genres"])
 
             progress_bar.update(1)
 
 
 class TMDBMovieAdditionalInfoFetcher(BaseFetcher):
-    def __init__(self, data_directory: str):
-        self.selected_titles_file = Path(data_directory, "top_rated_movies.csv")
-        self.additional_info_file = Path(data_directory, "additional_info.csv")
-
-    def __select_ids(self):
-        selected_titles = pd.read_csv(self.selected_titles_file)
-        self.selected_ids = selected_titles["id"].values
-
-    def __fetch_additional_info(self, id: int):
-        movies = tmdb.Movies(id)
-        info = movies.info()
+    SCHEMA = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("budget", pa.int64()),
+            ("revenue", pa.int64()),
+            ("imdb_id", pa.string()),
+            ("runtime", pa.int64()),
+            ("tagline", pa.string()),
+            ("countries", pa.string()),
+        ]
+    )
 
+    @staticmethod
+    def parse(info: dict):
         data = {
             "id": info["id"],
             "budget": info["budget"],
@@ -146,53 +172,131 @@ class TMDBMovieAdditionalInfoFetcher(BaseFetcher):
             "countries": ".".join([country["iso_3166_1"] for country in info["production_countries"]]),
         }
 
-        dataframe = pd.DataFrame([data])
-        self._write_to_file(self.additional_info_file, dataframe)
+        return data
 
-    def run(self):
-        self.__select_ids()
+    def __fetch_additional_info(self, id: int):
+        return self.parse(self.engine.get(f"movie/{id}"))
 
-        for id in tqdm(self.selected_ids, desc="Fetching movies additional info"):
-            self.__fetch_additional_info(id)
+    def run(self):
+        with (
+            self._checkpoint("additional_info") as checkpoint,
+            self._sink("additional_info", self.SCHEMA) as sink,
+        ):
+            for id, data in self.engine.map(
+                self.__fetch_additional_info,
+                self._select_ids(checkpoint),
+                desc="Fetching movies additional info",
+            ):
+                sink.write(data)
+                checkpoint.add(id)
+                self._commit(checkpoint, sink)
 
 
 class TMDBMovieKeywordsFetcher(BaseFetcher):
-    def __init__(self, data_directory: str):
-        self.selected_titles_file = Path(data_directory, "top_rated_movies.csv")
-        self.keywords_file = Path(data_directory, "keywords.csv")
+    SCHEMA = pa.schema([("id", pa.int64()), ("keywords", pa.list_(pa.string()))])
 
-    def __select_ids(self):
-        selected_titles = pd.read_csv(self.selected_titles_file)
-        self.selected_ids = selected_titles["id"].values
+    @staticmethod
+    def parse(keywords: dict):
+        return {"id": keywords["id"], "keywords": [keyword["name"] for keyword in keywords["keywords"]]}
 
     def __fetch_movies_keywords(self, id: int):
-        keywords = tmdb.Movies(id).keywords()
-        data = {"id": keywords["id"], "keywords": [keyword["name"] for keyword in keywords["keywords"]]}
-
-        dataframe = pd.DataFrame([data])
-        self._write_to_file(self.keywords_file, dataframe)
+        return self.parse(self.engine.get(f"movie/{id}/keywords"))
 
     def run(self):
-        self.__select_ids()
+        with self._checkpoint("keywords") as checkpoint, self._sink("keywords", self.SCHEMA) as sink:
+            for id, data in self.engine.map(
+                self.__fetch_movies_keywords, self._select_ids(checkpoint), desc="Fetching movies keywords"
+            ):
+                sink.write(data)
+                checkpoint.add(id)
+                self._commit(checkpoint, sink)
 
-        for id in tqdm(self.selected_ids, desc="Fetching movies keywords"):
-            self.__fetch_movies_keywords(id)
+
+class TMDBMovieDetailsFetcher(BaseFetcher):
+    """Additional info, keywords and watch providers in one request per movie.
+
+    Uses ``append_to_response`` and writes the same outputs as the three fetchers it replaces.
+    """
+
+    APPENDED = ["keywords", "watch/providers"]
+
+    def __fetch_movie_details(self, id: int):
+        details = self.engine.get(f"movie/{id}", append_to_response=",".join(self.APPENDED))
+        return (
+            TMDBMovieAdditionalInfoFetcher.parse(details),
+            TMDBMovieKeywordsFetcher.parse({"id": details["id"], **details["keywords"]}),
+            TMDBMovieProvidersFetcher.parse({"id": details["id"], **details["watch/providers"]}),
+        )
+
+    def run(self):
+        with (
+            self._checkpoint("movie_details") as checkpoint,
+            self._sink("additional_info", TMDBMovieAdditionalInfoFetcher.SCHEMA) as additional_info_sink,
+            self._sink("keywords", TMDBMovieKeywordsFetcher.SCHEMA) as keywords_sink,
+            self._sink("movie_providers", TMDBMovieProvidersFetcher.SCHEMA) as providers_sink,
+        ):
+            for id, (additional_info, keywords, providers) in self.engine.map(
+                self.__fetch_movie_details, self._select_ids(checkpoint), desc="Fetching movies details"
+            ):
+                additional_info_sink.write(additional_info)
+                keywords_sink.write(keywords)
+                providers_sink.write_many(providers)
+                checkpoint.add(id)
+                self._commit(checkpoint, additional_info_sink, keywords_sink, providers_sink)
+
+
+FETCHERS = {
+    "top_rated": TMDBTopRatedMoviesFetcher,
+    "movie_providers": TMDBMovieProvidersFetcher,
+    "providers": TMDBProvidersFetcher,
+    "genres": TMDBGenresFetcher,
+    "additional_info": TMDBMovieAdditionalInfoFetcher,
+    "keywords": TMDBMovieKeywordsFetcher,
+    "details": TMDBMovieDetailsFetcher,
+}
+COMBINED_FETCHERS = [TMDBMovieProvidersFetcher, TMDBMovieAdditionalInfoFetcher, TMDBMovieKeywordsFetcher]
 
 
 def main(
     data_directory: str = typer.Option(
         help="Specify the data_directory to store the data.", default="data/raw/tmdb"
-    )
+    ),
+    concurrency: int = typer.Option(help="Requests in flight at once.", default=8),
+    rate: float = typer.Option(help="Requests per second allowed by the token bucket.", default=40.0),
+    base_url: str = typer.Option(help="TMDB API root, e.g. a local stub server.", default=TMDB_BASE_URL),
+    output_format: str = typer.Option(help=f"One of {', '.join(FORMATS)}.", default="parquet"),
+    fetchers: str = typer.Option(
+        help=f"Comma separated fetchers to run, in order: {', '.join(FETCHERS)}.", default="top_rated"
+    ),
+    combined: bool = typer.Option(
+        help="Fetch movie providers, additional info and keywords with one request per movie, "
+        "in place of those fetchers or after the selected ones.",
+        default=False,
+    ),
+    resume: bool = typer.Option(help="Skip the movies completed by previous runs.", default=True),
+    metrics_file: str = typer.Option(
+        help="Write the run's Prometheus metrics to this .prom file for the node exporter.", default=None
+    ),
 ):
-    for fetcher in [
-        TMDBTopRatedMoviesFetcher,
-        # TMDBMovieProvidersFetcher,
-        # TMDBProvidersFetcher,
-        # TMDBGenresFetcher,
-        # TMDBMovieAdditionalInfoFetcher,
-        # TMDBMovieKeywordsFetcher,
-    ]:
-        fetcher(data_directory).run()
+    names = [name.strip() for name in fetchers.split(",") if name.strip()]
+    unknown = [name for name in names if name not in FETCHERS]
+    if unknown:
+        raise typer.BadParameter(f"Unknown fetchers {unknown}, expected some of {', '.join(FETCHERS)}")
+    selected = [FETCHERS[name] for name in names]
+    if combined:
+        selected = [fetcher for fetcher in selected if fetcher not in COMBINED_FETCHERS]
+        if TMDBMovieDetailsFetcher not in selected:
+            selected.append(TMDBMovieDetailsFetcher)
+
+    engine = FetchEngine(API_KEY, base_url, concurrency, rate)
+
+    with JobMetrics("tmdb_fetcher", metrics_file):
+        for fetcher in selected:
+            fetcher(data_directory, engine, output_format, resume).run()
+
+    if engine.failed:
+        print(f"{len(engine.failed)} requests failed after retries")
+    engine.close()
 
 
 if __name__ == "__main__":